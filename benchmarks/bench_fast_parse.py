@@ -0,0 +1,215 @@
+"""
+Time each stage of `fast_parse` on synthetic v0 and v1 videos.
+
+    $ uv run -m benchmarks.bench_fast_parse --seconds 30 --decode gray
+
+Stages are run one after another over the whole video, so the decode stage
+holds every frame in memory; the end to end run streams as usual and is run in
+a fresh process to report its peak RSS.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple, TypeVar
+
+from rcttools.detection import (
+    SPARSE_SAMPLE_STEP,
+    SPARSE_STACK_STEP,
+    ChangeDetector,
+    DiffChangeDetector,
+    SparseChangeDetector,
+)
+from rcttools.rct2gpx import (
+    DECODE_MODES,
+    DEFAULT_CHUNK_SIZE,
+    StackedFrameReader,
+    _Update,
+    fast_parse,
+    select_y_offset,
+    stream_video,
+    write_gpx,
+)
+from rcttools.text_format import EmbeddedData, StateMachine
+
+from .synthetic import STARTS, render
+
+LAYOUTS = {"v0": 0, "v1": -1}
+
+T = TypeVar("T")
+
+
+def _timed(func: Callable[[], T]) -> Tuple[T, float]:
+    start = time.perf_counter()
+    output = func()
+    return output, time.perf_counter() - start
+
+
+def _peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _end_to_end(
+    mp4_path: str, kwargs: Dict[str, Any]
+) -> Tuple[Dict[int, EmbeddedData], float, float, float]:
+    output, duration = _timed(lambda: fast_parse(mp4_path, **kwargs))
+    return (
+        output[0],
+        duration,
+        _peak_rss_mb(),
+        _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    )
+
+
+def _accuracy(result: Dict[int, EmbeddedData], truth: Dict[int, EmbeddedData]) -> float:
+    # Frame indexes of updates can be off by a frame or two depending on the
+    # decode mode, so only the order of the updates is compared
+    expected = [truth[k] for k in sorted(truth)]
+    found = [result[k] for k in sorted(result)]
+    return sum(a == b for a, b in zip(found, expected)) / len(expected)
+
+
+def bench_stages(
+    mp4_path: str, truth: Dict[int, EmbeddedData], kwargs: Dict[str, Any]
+) -> Dict[str, float]:
+    """
+    Return the seconds spent in each stage, and the accuracy of the results.
+    """
+    sample_step = kwargs.get("sample_step", 1)
+    stack_step = kwargs.get("stack_step", 1)
+    chunks, decode_time = _timed(
+        lambda: list(
+            stream_video(
+                mp4_path,
+                kwargs.get("chunk_size", DEFAULT_CHUNK_SIZE),
+                kwargs.get("decode", "threshold"),
+                kwargs.get("skip_nonref", False),
+            )
+        )
+    )
+
+    def detect() -> Tuple[int, List[List[Tuple[int, float]]]]:
+        y_offset = select_y_offset(chunks[0][::sample_step])
+        detector: ChangeDetector
+        if sample_step > 1:
+            detector = SparseChangeDetector(y_offset, sample_step)
+        elif kwargs.get("pixel_diff", True):
+            detector = DiffChangeDetector(y_offset)
+        else:
+            detector = ChangeDetector(y_offset)
+        changes = []
+        frame_index = 0
+        for ink in chunks:
+            changes.append(detector.detect(ink, frame_index))
+            frame_index += len(ink)
+        return y_offset, changes
+
+    (y_offset, changes), detect_time = _timed(detect)
+
+    def stack() -> List[_Update]:
+        updates: List[_Update] = []
+        frame_index = 0
+        for ink, chunk_changes in zip(chunks, changes):
+            starts = [change - frame_index for change, _ in chunk_changes]
+            if updates and (not starts or starts[0] > 0):
+                updates[-1].add(ink[: starts[0] if starts else len(ink)], frame_index)
+            for i, (change, score) in enumerate(chunk_changes):
+                updates.append(_Update(change, score, stack_step))
+                end = starts[i + 1] if i + 1 < len(starts) else len(ink)
+                updates[-1].add(ink[starts[i] : end], change)
+            frame_index += len(ink)
+        return [u for u in updates[:-1] if u.score > 0.8] + updates[-1:]
+
+    updates, stack_time = _timed(stack)
+    stacked_frames = [update.stacked_frame() for update in updates]
+
+    reader = StackedFrameReader(StateMachine(use_parity=y_offset != 0), y_offset)
+    reads, ocr_time = _timed(lambda: [reader.read(f)[0] for f in stacked_frames])
+    result = {update.frame_index: data for update, data in zip(updates, reads)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, gpx_time = _timed(
+            lambda: write_gpx([result], os.path.join(directory, "bench.gpx"))
+        )
+
+    return {
+        "decode": decode_time,
+        "detect": detect_time,
+        "stack": stack_time,
+        "ocr": ocr_time,
+        "gpx": gpx_time,
+        "frames": sum(len(ink) for ink in chunks),
+        "accuracy": _accuracy(result, truth),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time each stage of fast_parse on synthetic videos"
+    )
+    parser.add_argument("--seconds", type=int, default=30, help="Video length")
+    parser.add_argument(
+        "--speckle",
+        type=float,
+        default=0.0,
+        help="Fraction of super-white noise pixels per frame",
+    )
+    parser.add_argument("--decode", choices=DECODE_MODES, default="threshold")
+    parser.add_argument("--skip-nonref", action="store_true")
+    parser.add_argument("--sparse", action="store_true")
+    parser.add_argument("--no-pixel-diff", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        "--video-directory",
+        type=str,
+        default=None,
+        help="Keep the rendered videos in this directory",
+    )
+    args = parser.parse_args()
+
+    kwargs: Dict[str, Any] = dict(
+        chunk_size=args.chunk_size,
+        decode=args.decode,
+        skip_nonref=args.skip_nonref,
+        sample_step=SPARSE_SAMPLE_STEP if args.sparse else 1,
+        stack_step=SPARSE_STACK_STEP if args.sparse else 1,
+        pixel_diff=not args.no_pixel_diff,
+    )
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = args.video_directory or temporary_directory
+        os.makedirs(directory, exist_ok=True)
+        print(
+            f"{'layout':<7}{'stage':<8}{'seconds':>9}{'frames/s':>10}"
+            f"{'accuracy':>10}{'peak RSS MB':>13}{'ffmpeg MB':>11}"
+        )
+        for (name, y_offset), start in zip(LAYOUTS.items(), STARTS):
+            mp4_path = os.path.join(
+                directory, f"{name}_{args.seconds}s_{args.speckle}.mp4"
+            )
+            truth = render(mp4_path, args.seconds, y_offset, args.speckle, start=start)
+
+            stages = bench_stages(mp4_path, truth, kwargs)
+            frames = stages.pop("frames")
+            accuracy = stages.pop("accuracy")
+            for stage, seconds in stages.items():
+                print(f"{name:<7}{stage:<8}{seconds:>9.3f}{frames / seconds:>10.0f}")
+
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result, seconds, rss, ffmpeg_rss = executor.submit(
+                    _end_to_end, mp4_path, kwargs
+                ).result()
+            print(
+                f"{name:<7}{'total':<8}{seconds:>9.3f}{frames / seconds:>10.0f}"
+                f"{_accuracy(result, truth):>10.3f}{rss:>13.0f}{ffmpeg_rss:>11.0f}"
+            )
+            print(f"{name:<7}{'stages':<8}{'':>9}{'':>10}{accuracy:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
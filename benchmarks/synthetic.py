@@ -0,0 +1,153 @@
+"""
+Render synthetic RCT715 footage: the data band drawn with the glyphs of
+`rcttools/data/` over a noisy road-like background, encoded with ffmpeg.
+"""
+
+import datetime as dt
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+import ffmpeg  # type: ignore[import-untyped]
+import numpy as np
+
+from rcttools.alphabet import NEGATIVE, NUMBERS
+from rcttools.rct2gpx import BAND_HEIGHT, BAND_WIDTH, BAND_Y
+from rcttools.text_format import EmbeddedData, StateMachine
+
+WIDTH = 1920
+HEIGHT = 1080
+FPS = 30
+# Luma of the text and its border; the text is above the white level (235)
+TEXT_LUMA = 250
+BORDER_LUMA = 16
+# yuv420p crops are rounded to even rows
+_BAND_TOP = BAND_Y - BAND_Y % 2
+
+
+# Coordinates of the first update of each rendered video, close to where a
+# coordinate changes sign or number of integer digits
+STARTS = (
+    (Decimal("9.99985"), Decimal("0.00020")),
+    (Decimal("-10.00020"), Decimal("-99.99990")),
+)
+
+
+def _coordinate_chars(value: Decimal) -> List[str]:
+    # The sign is right-aligned against the integer digits, in 4 cells
+    sign = "-" if value < 0 else ""
+    integer, fraction = f"{abs(value):.5f}".split(".")
+    cells = [*" " * (4 - len(sign) - len(integer)), *sign, *integer]
+    return ["" if cells[0] == " " else cells[0], *cells[1:], *fraction]
+
+
+def layout(data: EmbeddedData, use_parity: bool) -> List[Tuple[int, str]]:
+    """
+    The horizontal offset of each character read by `StateMachine`.
+    """
+    assert data["latitude"] is not None and data["longitude"] is not None
+    chars = iter(
+        [
+            *data["datetime"].strftime("%Y%m%d%H%M%S"),
+            *_coordinate_chars(data["latitude"]),
+            *_coordinate_chars(data["longitude"]),
+        ]
+    )
+    state_machine = StateMachine(use_parity=use_parity)
+    cells = []
+    while not state_machine.is_complete():
+        if state_machine.get_alphabet() == {}:
+            continue
+        offset = state_machine.get_next_offset()
+        char = next(chars)
+        cells.append((offset, char))
+        state_machine.append(char)
+    return cells
+
+
+def render_band(
+    cells: List[Tuple[int, str]], y_offset: int
+) -> Tuple[np.ndarray[Any, np.dtype[np.bool_]], np.ndarray[Any, np.dtype[np.bool_]]]:
+    """
+    Text and border masks of the data band, in the rows of the cropped band.
+    """
+    text = np.zeros((BAND_HEIGHT, BAND_WIDTH), dtype=bool)
+    for offset, char in cells:
+        if not (char.isdigit() or char == "-"):
+            continue
+        mask = (NUMBERS[char] if char.isdigit() else NEGATIVE).mask
+        rows = slice(5 + y_offset, 5 + y_offset + mask.shape[0])
+        text[rows, offset : offset + mask.shape[1]] |= mask
+    border = np.zeros_like(text)
+    for dy, dx in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        border |= np.roll(text, (dy, dx), axis=(0, 1))
+    return text, border & ~text
+
+
+def render(
+    path: str,
+    seconds: int = 30,
+    y_offset: int = 0,
+    speckle: float = 0.0,
+    seed: int = 0,
+    start: Tuple[Decimal, Decimal] = STARTS[0],
+) -> Dict[int, EmbeddedData]:
+    """
+    Encode a synthetic video to `path`, returning the embedded data keyed by
+    the first frame of each update.
+
+    `y_offset` selects the v0 (0) or v1 (-1, with digit parity) layout. The
+    background is asphalt-like texture with a lane marking sweeping through the
+    band, plus a `speckle` fraction of super-white pixels in each frame. The
+    coordinates move away from the `start` latitude and longitude by a few
+    meters per update.
+    """
+    rng = np.random.default_rng(seed)
+    process = (
+        ffmpeg.input(
+            "pipe:",
+            format="rawvideo",
+            pix_fmt="yuv420p",
+            s=f"{WIDTH}x{HEIGHT}",
+            framerate=FPS,
+        )
+        .output(path, vcodec="libx264", pix_fmt="yuv420p", crf=12, preset="veryfast")
+        .overwrite_output()
+        .run_async(pipe_stdin=True, quiet=True)
+    )
+    truth: Dict[int, EmbeddedData] = {}
+    data = EmbeddedData(
+        datetime=dt.datetime(2025, 6, 1, 13, 45, 49),
+        latitude=start[0],
+        longitude=start[1],
+    )
+    # Luma is written as is, in limited range, with neutral chroma
+    chroma = np.full(WIDTH * HEIGHT // 2, 128, dtype=np.uint8).tobytes()
+    asphalt = rng.integers(50, 110, (HEIGHT, WIDTH), dtype=np.uint8)
+    next_update = 0
+    for i in range(seconds * FPS):
+        if i == next_update:
+            if truth:
+                assert data["latitude"] is not None and data["longitude"] is not None
+                data = EmbeddedData(
+                    datetime=data["datetime"] + dt.timedelta(seconds=1),
+                    latitude=data["latitude"] + Decimal("0.00003"),
+                    longitude=data["longitude"] - Decimal("0.00002"),
+                )
+            truth[i] = data
+            text, border = render_band(layout(data, y_offset != 0), y_offset)
+            # Updates arrive every [29, 32] frames
+            next_update += int(rng.integers(29, 33))
+        frame = np.roll(asphalt, i * 7, axis=1)
+        band = frame[_BAND_TOP : _BAND_TOP + BAND_HEIGHT, :BAND_WIDTH]
+        marking = (i * 23) % (BAND_WIDTH + 200) - 100
+        band[:, max(marking, 0) : max(marking + 60, 0)] = 225
+        if speckle:
+            band[rng.random(band.shape) < speckle] = TEXT_LUMA
+        band[border] = BORDER_LUMA
+        band[text] = TEXT_LUMA
+        process.stdin.write(frame.tobytes())
+        process.stdin.write(chroma)
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {path}")
+    return truth
@@ -1,60 +1,248 @@
+import hashlib
 import os
-from typing import Dict, Tuple
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import cache, cached_property
+from typing import Any, Dict, Hashable, Optional, Tuple
 
 import numpy as np
-from PIL import Image
 
-from .common import FLOAT_FRAME_TYPE, FLOAT_VIDEO_TYPE, VIDEO_LENGTH
+from .cache import default_cache_directory
+from .common import (
+    INK_FRAME_TYPE,
+    PACKED_VIDEO_TYPE,
+    VIDEO_LENGTH,
+    popcount,
+)
 
 BASE_PATH = os.path.dirname(__file__)
+GLYPHS = [str(x) for x in range(10)] + ["-"]
+# Masks of all glyphs, precompiled from the PNGs by `compile_glyphs`
+GLYPHS_PATH = os.path.join(BASE_PATH, "data", "glyphs.npz")
+
+MASK_TYPE = np.ndarray[Tuple[int, int], np.dtype[np.bool_]]
+
+
+def _png_path(char: str) -> str:
+    return os.path.join(BASE_PATH, "data", f"{char}.png")
+
+
+def compile_glyphs(path: Optional[str] = GLYPHS_PATH) -> Dict[str, MASK_TYPE]:
+    """
+    Decode the glyph PNGs into boolean masks and save them to `path`, if given.
+    """
+    # Pillow is only needed when the PNGs change
+    from PIL import Image
+
+    masks = {
+        char: (1 - 1.0 * np.array(Image.open(_png_path(char)).convert("L")) / 255) > 0.5
+        for char in GLYPHS
+    }
+    if path is None:
+        return masks
+    # Written atomically, as worker processes may load the glyphs concurrently
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **masks)  # type: ignore[arg-type]
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return masks
+
+
+def _load_npz(path: str) -> Dict[str, MASK_TYPE]:
+    with np.load(path) as data:
+        return {char: data[char] for char in GLYPHS}
+
+
+@cache
+def load_glyphs() -> Dict[str, MASK_TYPE]:
+    """
+    Load the glyph masks on first use, from the precompiled masks if they are
+    at least as recent as the PNGs.
+
+    Otherwise the PNGs are compiled into the cache directory, keyed by their
+    content, so that other processes can load them. Nothing is written to the
+    package, which may be read-only.
+    """
+    sources = [_png_path(char) for char in GLYPHS]
+    try:
+        compiled = os.stat(GLYPHS_PATH).st_mtime_ns
+        # Installed packages may only ship the precompiled masks
+        if all(
+            not os.path.exists(path) or os.stat(path).st_mtime_ns <= compiled
+            for path in sources
+        ):
+            return _load_npz(GLYPHS_PATH)
+    except (FileNotFoundError, KeyError):
+        pass
+    digest = hashlib.sha256()
+    for path in sources:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    cached_path = os.path.join(
+        default_cache_directory(), f"glyphs-{digest.hexdigest()[:16]}.npz"
+    )
+    try:
+        return _load_npz(cached_path)
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        return compile_glyphs(cached_path)
+    except OSError:
+        return compile_glyphs(None)
 
 
 class Character:
     def __init__(self, char: str) -> None:
-        self.path = os.path.join(BASE_PATH, "data", f"{char}.png")
-        self.array = np.array(Image.open(self.path))
-        self.mask = (1 - 1.0 * self.array / 255) > 0.5
-        self.mask_4d = self.mask[np.newaxis, :]
-
-    def score_frame(self, frame: FLOAT_FRAME_TYPE) -> float:
-        union_mask: np.ndarray[Tuple[int], np.dtype[np.bool_]] = np.logical_or(
-            self.mask, frame
-        )
-        return 1.0 * int(frame[self.mask].sum()) / int(union_mask.sum())
-
-    def score_video(
-        self, frame: FLOAT_VIDEO_TYPE
-    ) -> np.ndarray[Tuple[VIDEO_LENGTH], np.dtype[np.float32]]:
-        mask_4d = np.tile(self.mask_4d, (frame.shape[0], 1, 1, 1))
-        union_mask = np.logical_or(mask_4d, frame)
-        return (  # type: ignore[no-any-return]
-            1.0 * (frame * mask_4d).sum(axis=(1, 2, 3)) / union_mask.sum(axis=(1, 2, 3))
-        )
+        self.char = char
+        self.path = _png_path(char)
+
+    @cached_property
+    def mask(self) -> MASK_TYPE:
+        return load_glyphs()[self.char]
+
+    def score_frame(self, frame: INK_FRAME_TYPE) -> float:
+        """
+        Score a frame of ink levels, where 255 is ink in every stacked frame.
+        """
+        union = int(np.count_nonzero(self.mask | (frame != 0)))
+        return float(frame[self.mask].sum(dtype=np.int64)) / 255 / union
 
 
 class FixedScore(Character):
     def __init__(self, score: float) -> None:
         self.score = score
 
-    def score_frame(self, frame: FLOAT_FRAME_TYPE) -> float:
+    def score_frame(self, frame: INK_FRAME_TYPE) -> float:
         return self.score
 
-    def score_video(
-        self, frame: FLOAT_VIDEO_TYPE
-    ) -> np.ndarray[Tuple[VIDEO_LENGTH], np.dtype[np.float32]]:
-        return np.full(frame.shape[0], self.score, dtype=np.float32)
 
+class Alphabet:
+    """
+    Characters of a common shape, scored together against a batch of frames.
 
-NUMBERS = {str(x): Character(str(x)) for x in range(10)}
+    The masks are stacked into a `[K, H, ceil(W / 8)]` bit-packed array so that
+    a batch of `N` binary frames is scored against every character at once.
+    """
 
-_number_shapes = {k: v.array.shape for k, v in NUMBERS.items()}
-if len(set(_number_shapes.values())) > 1:
-    formatted_output = "\n".join(f"{k} = {v}" for k, v in _number_shapes.items())
-    raise ValueError(
-        f"Numerical characters are not a consistent shape:\n{formatted_output}"
-    )
+    def __init__(self, characters: Dict[str, Character]) -> None:
+        self.characters = characters
+        self.letters = list(characters.keys())
+        self.fixed_scores = {
+            i: character.score
+            for i, character in enumerate(characters.values())
+            if isinstance(character, FixedScore)
+        }
+
+    # The masks are only loaded on first use
+    @cached_property
+    def shape(self) -> Tuple[int, ...]:
+        shapes = {
+            character.mask.shape
+            for character in self.characters.values()
+            if not isinstance(character, FixedScore)
+        }
+        if len(shapes) != 1:
+            raise ValueError(f"Characters must have a single shape: {shapes}")
+        return shapes.pop()
+
+    @cached_property
+    def masks(self) -> np.ndarray[Tuple[int, int], np.dtype[np.float64]]:
+        return np.stack(
+            [
+                (
+                    np.zeros(self.shape, dtype=np.bool_)
+                    if isinstance(character, FixedScore)
+                    else character.mask
+                ).reshape(-1)
+                for character in self.characters.values()
+            ]
+        ).astype(np.float64)
 
-NUMBERS_SHAPE = list(set(_number_shapes.values()))[0]
+    @cached_property
+    def mask_sizes(self) -> np.ndarray[Tuple[int], np.dtype[np.float64]]:
+        return self.masks.sum(axis=1)  # type: ignore[no-any-return]
+
+    @cached_property
+    def packed(self) -> np.ndarray[Any, np.dtype[np.uint8]]:
+        return np.packbits(self.masks.reshape(-1, *self.shape) != 0, axis=-1)
+
+    def score_packed(
+        self, frame: PACKED_VIDEO_TYPE
+    ) -> np.ndarray[Tuple[VIDEO_LENGTH, int], np.dtype[np.float64]]:
+        """
+        Score bit-packed binary frames from `np.packbits(..., axis=-1)` against
+        every character, returning an `[N, K]` matrix with columns in the order
+        of `letters`.
+
+        The intersection is the popcount of `frame & mask`; the union follows
+        from it as `popcount(frame) + popcount(mask) - intersection`.
+        """
+        flat = frame.reshape(frame.shape[0], 1, -1)
+        intersection = popcount(flat & self.packed.reshape(1, len(self.letters), -1))
+        overlap = intersection.sum(axis=2, dtype=np.int64)
+        ink = popcount(flat).sum(axis=2, dtype=np.int64)
+        union = ink + self.mask_sizes - overlap
+        scores = np.divide(overlap, union, out=np.zeros(overlap.shape), where=union > 0)
+        for i, score in self.fixed_scores.items():
+            scores[:, i] = score
+        return scores  # type: ignore[no-any-return]
+
+
+# Scores of every candidate letter at every shift of a character cell's window
+CellScores = np.ndarray[Tuple[int, int], np.dtype[np.float64]]
+DEFAULT_MEMO_ENTRIES = 4096
+
+
+class GlyphMemo:
+    """
+    Least recently used cache of the scores of a character cell, keyed by the
+    candidate letters and a hash of the ink levels of the cell's window.
+
+    Fixed fields (the date, the integer part of coordinates) produce identical
+    stacked cells from one update to the next, so their scores can be reused.
+    The ink levels are hashed exactly, rather than binarized, as scores depend
+    on them. The memo can be shared by threads.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MEMO_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Hashable, CellScores] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(letters: Tuple[str, ...], cell: INK_FRAME_TYPE) -> Hashable:
+        digest = hashlib.blake2b(cell.tobytes(), digest_size=16).digest()
+        return letters, cell.shape, digest
+
+    def get(self, key: Hashable) -> Optional[CellScores]:
+        with self.lock:
+            scores = self.entries.get(key)
+            if scores is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return scores
+
+    def put(self, key: Hashable, scores: CellScores) -> None:
+        with self.lock:
+            self.entries[key] = scores
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+NUMBERS = {str(x): Character(str(x)) for x in range(10)}
+# Numbers must have a consistent shape, which is checked on first use
+NUMBERS_ALPHABET = Alphabet(NUMBERS)
 
 NEGATIVE = Character("-")
 NEGATIVE_OR_NUMBER: Dict[str, Character] = {
@@ -66,3 +254,7 @@ NEGATIVE_OR_NOTHING: Dict[str, Character] = {
     "-": NEGATIVE,
     "": FixedScore(0.8),
 }
+
+
+if __name__ == "__main__":
+    compile_glyphs()
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import json
+import os
+from types import TracebackType
+from typing import Any, Dict, Iterator, Optional, Tuple, Type
+
+import numpy as np
+
+from .common import BOOL_VIDEO_TYPE, video_file_name
+
+BAND_EXTENSION = ".rctband"
+BAND_MAGIC = b"RCTBAND\0"
+BAND_VERSION = 1
+# Frames start at a multiple of this offset, after the magic and the header
+HEADER_ALIGNMENT = 64
+
+
+def band_path(directory: str, mp4_path: str) -> str:
+    """
+    Path of the band file of a video in `directory`, named after the video and
+    a hash of its absolute path.
+    """
+    return os.path.join(directory, video_file_name(mp4_path, BAND_EXTENSION))
+
+
+class BandWriter:
+    """
+    Write boolean ink frames to a band file, bit-packed along the width unless
+    `packed` is false, so that they can be memory-mapped by `open_band`.
+
+    The header records the frame shape, the packing and any other `metadata`,
+    e.g. the crop geometry and decode options. Like `GPXWriter`, the file is
+    written under a temporary name and only replaces `path` once closed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        height: int,
+        width: int,
+        packed: bool = True,
+        **metadata: Any,
+    ) -> None:
+        self.path = path
+        self.tmp_path = f"{path}.part"
+        self.height = height
+        self.width = width
+        self.packed = packed
+        header = json.dumps(
+            {
+                "version": BAND_VERSION,
+                "height": height,
+                "width": width,
+                "packed": packed,
+                **metadata,
+            }
+        ).encode()
+        size = len(BAND_MAGIC) + 4 + len(header)
+        header += b" " * (-size % HEADER_ALIGNMENT)
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(BAND_MAGIC)
+        self.file.write(len(header).to_bytes(4, "little"))
+        self.file.write(header)
+        self.frames = 0
+
+    def add(self, ink: BOOL_VIDEO_TYPE) -> None:
+        if ink.shape[1:] != (self.height, self.width):
+            raise ValueError(f"Unexpected frame shape: {ink.shape[1:]}")
+        frames = np.packbits(ink, axis=-1) if self.packed else ink.view(np.uint8)
+        self.file.write(np.ascontiguousarray(frames).data)
+        self.frames += len(ink)
+
+    def close(self) -> None:
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.file.close()
+        os.unlink(self.tmp_path)
+
+    def __enter__(self) -> BandWriter:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_header(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Header of a band file, or None if it is missing or not a band file of this
+    version.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(BAND_MAGIC)) != BAND_MAGIC:
+                return None
+            size = int.from_bytes(f.read(4), "little")
+            header: Dict[str, Any] = json.loads(f.read(size))
+    except (OSError, ValueError):
+        return None
+    if header.get("version") != BAND_VERSION:
+        return None
+    header["offset"] = len(BAND_MAGIC) + 4 + size
+    return header
+
+
+def open_band(path: str) -> Tuple[np.memmap[Any, np.dtype[np.uint8]], Dict[str, Any]]:
+    """
+    Memory-map the frames of a band file, returning them as they were written
+    (bit-packed or not) along with the header.
+    """
+    header = read_header(path)
+    if header is None:
+        raise ValueError(f"Not a band file: {path}")
+    width = (header["width"] + 7) // 8 if header["packed"] else header["width"]
+    frame_size = header["height"] * width
+    frame_count = (os.path.getsize(path) - header["offset"]) // frame_size
+    frames: np.memmap[Any, np.dtype[np.uint8]] = np.memmap(
+        path,
+        dtype=np.uint8,
+        mode="r",
+        offset=header["offset"],
+        shape=(frame_count, header["height"], width),
+    )
+    return frames, header
+
+
+def stream_band(path: str, chunk_size: int) -> Iterator[BOOL_VIDEO_TYPE]:
+    """
+    Yield the frames of a band file as boolean ink frames, in chunks of at most
+    `chunk_size` frames like `stream_video`.
+    """
+    frames, header = open_band(path)
+    for start in range(0, len(frames), chunk_size):
+        chunk = frames[start : start + chunk_size]
+        if header["packed"]:
+            yield np.unpackbits(chunk, axis=-1, count=header["width"]).view(np.bool_)
+        else:
+            yield np.asarray(chunk).view(np.bool_)
+
+
+def save_band(
+    chunks: Iterator[BOOL_VIDEO_TYPE], writer: BandWriter
+) -> Iterator[BOOL_VIDEO_TYPE]:
+    """
+    Pass `chunks` through, writing them to `writer`, which is closed once they
+    are exhausted or aborted if they are not read to the end.
+    """
+    complete = False
+    try:
+        for chunk in chunks:
+            writer.add(chunk)
+            yield chunk
+        complete = True
+    finally:
+        if complete:
+            writer.close()
+        else:
+            writer.abort()
@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from typing import Any, Dict, Optional
+
+# Bump when a change to parsing changes the results for the same video
+CACHE_VERSION = 4
+# Results are ~100 bytes per update, so this holds thousands of videos
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Bytes hashed from each end of the file
+FINGERPRINT_BYTES = 64 * 1024
+
+
+def default_cache_directory() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "rcttools")
+
+
+def _tool_version() -> str:
+    from importlib import metadata
+
+    try:
+        version = metadata.version("rcttools")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    return f"{version}/{CACHE_VERSION}"
+
+
+def fingerprint(path: str, **options: Any) -> str:
+    """
+    Cheap key for the parse results of a file: its size, modification time, the
+    first and last `FINGERPRINT_BYTES` of its content, the tool version and any
+    `options` affecting the results.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}:{_tool_version()}".encode())
+    digest.update(repr(sorted(options.items())).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(stat.st_size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Directory of pickled parse results, one file per fingerprint.
+
+    Once the directory exceeds `max_bytes`, the least recently used entries are
+    removed. Entries are written atomically, so the cache can be shared by
+    concurrent processes.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: int = DEFAULT_CACHE_BYTES,
+        refresh: bool = False,
+    ) -> None:
+        self.directory = directory or default_cache_directory()
+        self.max_bytes = max_bytes
+        # Ignore existing entries, replacing them as results are stored
+        self.refresh = refresh
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def get(self, key: str) -> Any:
+        """
+        Return the stored value for `key`, or None if there is none.
+        """
+        if self.refresh:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            # Access time is unreliable (noatime mounts), so use mtime for LRU
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logging.warning(f"Ignoring unreadable cache entry {path}", exc_info=True)
+            return None
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in
+        `max_bytes`.
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".pickle"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class LayoutCache:
+    """
+    y offset (v0 or v1 format) last found for the videos of each directory,
+    which usually hold the clips of a single device.
+
+    Offsets are kept in memory and, if `results` is given, stored alongside the
+    parse results so that later runs can reuse them.
+    """
+
+    def __init__(self, results: Optional[ResultCache] = None) -> None:
+        self.results = results
+        self.offsets: Dict[str, int] = {}
+
+    @staticmethod
+    def _key(directory: str) -> str:
+        name = f"layout:{CACHE_VERSION}:{directory}"
+        return hashlib.sha256(name.encode()).hexdigest()
+
+    def get(self, directory: str) -> Optional[int]:
+        directory = os.path.abspath(directory)
+        if directory not in self.offsets and self.results is not None:
+            y_offset = self.results.get(self._key(directory))
+            if isinstance(y_offset, int):
+                self.offsets[directory] = y_offset
+        return self.offsets.get(directory)
+
+    def put(self, directory: str, y_offset: int) -> None:
+        directory = os.path.abspath(directory)
+        if self.offsets.get(directory) == y_offset:
+            return
+        self.offsets[directory] = y_offset
+        if self.results is not None:
+            try:
+                self.results.put(self._key(directory), y_offset)
+            except OSError:
+                logging.warning(f"Failed to cache layout of {directory}", exc_info=True)
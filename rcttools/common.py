@@ -1,4 +1,6 @@
-from typing import Literal, Tuple
+import hashlib
+import os
+from typing import Any, Literal, Tuple
 
 import numpy as np
 
@@ -20,6 +22,40 @@ VIDEO_TYPE = np.ndarray[
 FLOAT_VIDEO_TYPE = np.ndarray[
     Tuple[VIDEO_LENGTH, FRAME_HEIGHT, FRAME_WIDTH, FRAME_CHANNELS], np.dtype[np.float64]
 ]
+# Single channel frames where 0 is background and 255 is ink, either thresholded
+# or stacked (fraction of frames with ink)
+INK_FRAME_TYPE = np.ndarray[Tuple[FRAME_HEIGHT, FRAME_WIDTH], np.dtype[np.uint8]]
+BOOL_VIDEO_TYPE = np.ndarray[
+    Tuple[VIDEO_LENGTH, FRAME_HEIGHT, FRAME_WIDTH], np.dtype[np.bool_]
+]
+# Binary frames packed along the width with np.packbits
+PACKED_VIDEO_TYPE = np.ndarray[
+    Tuple[VIDEO_LENGTH, FRAME_HEIGHT, int], np.dtype[np.uint8]
+]
+
+_POPCOUNT_TABLE = np.array([bin(x).count("1") for x in range(256)], dtype=np.uint8)
+
+
+def popcount(
+    array: np.ndarray[Any, np.dtype[np.uint8]],
+) -> np.ndarray[Any, np.dtype[np.uint8]]:
+    """
+    Count the set bits of each byte.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(array)  # type: ignore[no-any-return]
+    return _POPCOUNT_TABLE[array]  # type: ignore[no-any-return]
+
+
+def video_file_name(mp4_path: str, suffix: str) -> str:
+    """
+    Name of a file derived from a video and kept outside its directory: the
+    video's stem and a hash of its absolute path, followed by `suffix`.
+    """
+    digest = hashlib.sha256(os.path.abspath(mp4_path).encode()).hexdigest()[:16]
+    stem = os.path.basename(mp4_path).rsplit(".", 1)[0]
+    return f"{stem}-{digest}{suffix}"
+
 
 CHAR_WIDTHS = {str(x): 19 for x in range(10)}
 CHAR_WIDTHS["/"] = 14
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import glob
+import os
+import tempfile
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Sequence
+
+import pyarrow as pa  # type: ignore[import-untyped]
+
+from .common import video_file_name
+from .ride import RideRow
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DATASET_FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+# Columns of the dataset; `date` and `ride` are the partitions
+SCHEMA = pa.schema(
+    [
+        ("mp4_path", pa.string()),
+        ("frame_index", pa.int64()),
+        ("datetime", pa.timestamp("s")),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("goodness_of_fit", pa.float64()),
+    ]
+)
+PARTITIONING = pa.schema([("date", pa.string()), ("ride", pa.string())])
+
+
+def ride_table(
+    rows: Sequence[RideRow], goodness_of_fit: Mapping[str, pd.Series[float]]
+) -> Any:
+    """
+    Arrow table of the updates of a ride, with the goodness of fit of each
+    update looked up by video and frame index.
+    """
+    columns: Dict[str, list[Any]] = {name: [] for name in SCHEMA.names}
+    for mp4_path, frame_index, data in rows:
+        fits = goodness_of_fit.get(mp4_path)
+        columns["mp4_path"].append(mp4_path)
+        columns["frame_index"].append(frame_index)
+        columns["datetime"].append(data["datetime"])
+        for field in ("latitude", "longitude"):
+            value = data[field]
+            columns[field].append(None if value is None else float(value))
+        columns["goodness_of_fit"].append(
+            float(fits[frame_index])
+            if fits is not None and frame_index in fits.index
+            else None
+        )
+    return pa.table(columns, schema=SCHEMA)
+
+
+def append_ride(
+    directory: str,
+    rows: Sequence[RideRow],
+    goodness_of_fit: Mapping[str, pd.Series[float]],
+    file_format: str = "parquet",
+) -> List[str]:
+    """
+    Write the updates of a ride to the dataset in `directory`, one file per
+    video, partitioned as `date=<YYYY-MM-DD>/ride=<start time>/` by the time of
+    the ride's first update, and return their paths.
+
+    Files are named after their video, so parsing a video again replaces its
+    file, including one in another ride's partition, rather than duplicating
+    its rows.
+    """
+    if not rows:
+        return []
+    start = min(data["datetime"] for _, _, data in rows)
+    partition = os.path.join(
+        directory,
+        f"date={start:%Y-%m-%d}",
+        f"ride={start:%Y%m%dT%H%M%S}",
+    )
+    extension = "parquet" if file_format == "parquet" else "arrow"
+    videos: Dict[str, List[RideRow]] = {}
+    for row in rows:
+        videos.setdefault(row[0], []).append(row)
+
+    os.makedirs(partition, exist_ok=True)
+    paths = []
+    for mp4_path, video_rows in videos.items():
+        name = video_file_name(mp4_path, f".{extension}")
+        path = os.path.join(partition, name)
+        _write_table(ride_table(video_rows, goodness_of_fit), path, file_format)
+        paths.append(path)
+        # Rows of the video previously written to other rides
+        pattern = os.path.join(glob.escape(directory), "date=*", "ride=*", name)
+        for stale in glob.glob(pattern):
+            if not os.path.samefile(stale, path):
+                os.unlink(stale)
+    return paths
+
+
+def _write_table(table: Any, path: str, file_format: str) -> None:
+    # Written atomically, and hidden from dataset discovery until complete
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=".", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        if file_format == "parquet":
+            import pyarrow.parquet as pq  # type: ignore[import-untyped]
+
+            pq.write_table(table, tmp_path)
+        else:
+            from pyarrow import feather
+
+            feather.write_feather(table, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def open_dataset(directory: str, file_format: str = "parquet") -> Any:
+    """
+    `pyarrow.dataset.Dataset` of the rides in `directory`, which can be
+    filtered on the `date` and `ride` partitions without reading other files.
+    """
+    import pyarrow.dataset as ds  # type: ignore[import-untyped]
+
+    return ds.dataset(
+        directory,
+        format=DATASET_FORMATS[file_format],
+        partitioning=ds.partitioning(PARTITIONING, flavor="hive"),
+    )
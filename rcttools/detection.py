@@ -0,0 +1,178 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .alphabet import NUMBERS_ALPHABET
+from .common import BOOL_VIDEO_TYPE, PACKED_VIDEO_TYPE, VIDEO_LENGTH, popcount
+
+# Data updates arrive every [29, 32] frames, see README
+MIN_UPDATE_FRAMES = 29
+SPARSE_SAMPLE_STEP = 8
+SPARSE_STACK_STEP = 5
+# Pixels of the seconds digit cell that must differ from the last scored frame
+# for a frame to be scored. Consecutive digits differ by at least 24 pixels, so
+# a cell closer than this to the next digit scores as that digit.
+DIFF_MIN_PIXELS = 10
+
+# (frame index, score of the new seconds digit)
+Change = Tuple[int, float]
+
+
+def seconds_digit_cells(ink: BOOL_VIDEO_TYPE, y_offset: int) -> BOOL_VIDEO_TYPE:
+    """
+    View of the least significant time digit of each frame.
+    """
+    return ink[
+        :, (5 + y_offset) : (35 + y_offset), 561 : 561 + NUMBERS_ALPHABET.shape[1]
+    ]
+
+
+def score_seconds_digit(
+    ink: BOOL_VIDEO_TYPE, y_offset: int
+) -> np.ndarray[Tuple[VIDEO_LENGTH, int], np.dtype[np.float64]]:
+    """
+    Score each frame's least significant time digit against all numbers,
+    returning an `[N, 10]` matrix with columns in `NUMBERS_ALPHABET` order.
+    """
+    seconds_digit_video: PACKED_VIDEO_TYPE = np.packbits(
+        seconds_digit_cells(ink, y_offset), axis=-1
+    )
+    return NUMBERS_ALPHABET.score_packed(seconds_digit_video)
+
+
+class ChangeDetector:
+    """
+    Finds the frames where the seconds digit changes, one chunk of frames at a
+    time.
+
+    Every frame of a chunk is scored and a change is reported whenever the best
+    scoring digit differs from the previous frame's.
+    """
+
+    def __init__(self, y_offset: int) -> None:
+        self.y_offset = y_offset
+        self.previous_letter = -1
+        self.frames_scored = 0
+
+    def detect(self, ink: BOOL_VIDEO_TYPE, frame_index: int) -> List[Change]:
+        """
+        Return the changes within a chunk starting at `frame_index`, which must
+        directly follow the previous chunk.
+        """
+        scores = score_seconds_digit(ink, self.y_offset)
+        self.frames_scored += len(ink)
+        best_fit = scores.argmax(axis=1)
+        change_max = scores.max(axis=1)
+        changes = np.flatnonzero(np.diff(best_fit, prepend=self.previous_letter))
+        self.previous_letter = int(best_fit[-1])
+        return [(frame_index + int(c), float(change_max[c])) for c in changes]
+
+
+class SparseChangeDetector(ChangeDetector):
+    """
+    Finds changes by scoring every `step`-th frame, and bisecting between
+    samples that disagree to locate the exact frame of the change.
+
+    After a change, sampling resumes just before the next update is due
+    (`MIN_UPDATE_FRAMES` later), so only a handful of frames are scored per
+    update. The last frame of each chunk is always sampled, so that every change
+    is resolved before the next chunk arrives.
+    """
+
+    def __init__(self, y_offset: int, step: int = SPARSE_SAMPLE_STEP) -> None:
+        super().__init__(y_offset)
+        self.step = step
+        self.previous_index = -1
+        self.next_index = 0
+
+    def detect(self, ink: BOOL_VIDEO_TYPE, frame_index: int) -> List[Change]:
+        cells = seconds_digit_cells(ink, self.y_offset)
+
+        def score(index: int) -> Tuple[int, float]:
+            self.frames_scored += 1
+            scores = NUMBERS_ALPHABET.score_packed(
+                np.packbits(cells[index - frame_index : index - frame_index + 1], -1)
+            )[0]
+            return int(scores.argmax()), float(scores.max())
+
+        changes: List[Change] = []
+        last_index = frame_index + len(ink) - 1
+        while True:
+            index = min(self.next_index, last_index)
+            if index <= self.previous_index:
+                break
+            letter, letter_score = score(index)
+            next_index = index + self.step if index == self.next_index else None
+            while letter != self.previous_letter:
+                low, high = self.previous_index, index
+                high_letter, high_score = letter, letter_score
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    middle_letter, middle_score = score(middle)
+                    if middle_letter == self.previous_letter:
+                        low = middle
+                    else:
+                        high = middle
+                        high_letter, high_score = middle_letter, middle_score
+                changes.append((high, high_score))
+                self.previous_index, self.previous_letter = high, high_letter
+                next_index = max(high + MIN_UPDATE_FRAMES - 1, index + 1)
+            self.previous_index = index
+            if next_index is not None:
+                self.next_index = next_index
+        return changes
+
+
+class DiffChangeDetector(ChangeDetector):
+    """
+    Finds changes by comparing the seconds digit cell of every frame to that of
+    the last scored frame, as the popcount of their XOR, and only scoring the
+    frames that differ by at least `min_pixels`.
+
+    A scored frame is a change if its best scoring digit differs from the
+    previous one, and becomes the frame compared against. As updates are at
+    least `MIN_UPDATE_FRAMES` apart, a digit other than the next second arriving
+    sooner is taken to be noise, and is neither reported nor compared against.
+    """
+
+    def __init__(self, y_offset: int, min_pixels: int = DIFF_MIN_PIXELS) -> None:
+        super().__init__(y_offset)
+        self.min_pixels = min_pixels
+        self.reference: Optional[np.ndarray[Tuple[int, int], np.dtype[np.uint8]]] = None
+        self.previous_index = -MIN_UPDATE_FRAMES
+        self.frames_rejected = 0
+
+    def detect(self, ink: BOOL_VIDEO_TYPE, frame_index: int) -> List[Change]:
+        cells: PACKED_VIDEO_TYPE = np.packbits(
+            seconds_digit_cells(ink, self.y_offset), axis=-1
+        )
+        changes: List[Change] = []
+        start = 0
+        while start < len(cells):
+            if self.reference is None:
+                flagged = start
+            else:
+                distances = popcount(cells[start:] ^ self.reference).sum(
+                    axis=(1, 2), dtype=np.int64
+                )
+                above = np.flatnonzero(distances >= self.min_pixels)
+                if len(above) == 0:
+                    break
+                flagged = start + int(above[0])
+            start = flagged + 1
+            self.frames_scored += 1
+            scores = NUMBERS_ALPHABET.score_packed(cells[flagged : flagged + 1])[0]
+            letter = int(scores.argmax())
+            index = frame_index + flagged
+            if letter != self.previous_letter:
+                if (
+                    self.previous_letter >= 0
+                    and index - self.previous_index < MIN_UPDATE_FRAMES
+                    and letter != (self.previous_letter + 1) % 10
+                ):
+                    self.frames_rejected += 1
+                    continue
+                changes.append((index, float(scores.max())))
+                self.previous_letter, self.previous_index = letter, index
+            self.reference = cells[flagged].copy()
+        return changes
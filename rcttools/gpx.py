@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import os
+from decimal import Decimal
+from types import TracebackType
+from typing import Optional, Type
+
+from .text_format import EmbeddedData
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 '
+    'http://www.topografix.com/GPX/1/1/gpx.xsd" version="1.1" creator="rcttools">\n'
+    "  <trk>\n"
+)
+FOOTER = "  </trk>\n</gpx>"
+
+
+def _coordinate(value: Decimal) -> str:
+    # Trailing zeros dropped, as in gpxpy's output
+    return format(value.normalize(), "f")
+
+
+class GPXWriter:
+    """
+    Write a GPX file with a single track, one point at a time, so that points
+    reach the disk as updates are read and memory use does not grow with the
+    length of the track.
+
+    The file is written under a temporary name and only replaces `path` once
+    closed; it is removed if an exception leaves the `with` block.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.tmp_path = f"{path}.part"
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+        self.file.write(HEADER)
+        self.in_segment = False
+        self.points = 0
+
+    def new_segment(self) -> None:
+        if self.in_segment:
+            self.file.write("    </trkseg>\n")
+        self.file.write("    <trkseg>\n")
+        self.in_segment = True
+
+    def add(self, data: EmbeddedData) -> None:
+        """
+        Add the update to the current segment, unless it has no coordinates.
+        """
+        latitude, longitude = data["latitude"], data["longitude"]
+        if latitude is None or longitude is None:
+            return
+        if not self.in_segment:
+            self.new_segment()
+        self.file.write(
+            f'      <trkpt lat="{_coordinate(latitude)}" lon="{_coordinate(longitude)}">\n'
+            f"        <time>{data['datetime'].isoformat()}</time>\n"
+            "      </trkpt>\n"
+        )
+        self.points += 1
+
+    def close(self) -> None:
+        if self.in_segment:
+            self.file.write("    </trkseg>\n")
+        self.file.write(FOOTER)
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.file.close()
+        os.unlink(self.tmp_path)
+
+    def __enter__(self) -> GPXWriter:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
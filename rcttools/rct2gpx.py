@@ -1,159 +1,1341 @@
+from __future__ import annotations
+
+import glob
+import json
 import logging
-import os.path
-from datetime import datetime, timezone
-from typing import Dict, List, Tuple
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from functools import cache, partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    IO,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
-import ffmpeg  # type: ignore[import-untyped]
 import numpy as np
-import pandas as pd
-from gpxpy.gpx import GPX, GPXTrack, GPXTrackPoint, GPXTrackSegment
-from PIL import Image
+from numpy.lib.stride_tricks import sliding_window_view
 
-from .alphabet import NUMBERS, NUMBERS_SHAPE
+from .alphabet import (
+    NEGATIVE_OR_NOTHING,
+    NEGATIVE_OR_NUMBER,
+    Character,
+    FixedScore,
+    GlyphMemo,
+)
+from .band import (
+    BAND_EXTENSION,
+    BandWriter,
+    band_path,
+    read_header,
+    save_band,
+    stream_band,
+)
+from .cache import LayoutCache, ResultCache, fingerprint
 from .common import (
+    BOOL_VIDEO_TYPE,
     CHAR_WIDTHS,
-    FLOAT_FRAME_TYPE,
-    FLOAT_VIDEO_TYPE,
+    INK_FRAME_TYPE,
     VIDEO_TYPE,
 )
-from .text_format import EmbeddedData, StateMachine
+from .detection import (
+    SPARSE_SAMPLE_STEP,
+    SPARSE_STACK_STEP,
+    ChangeDetector,
+    DiffChangeDetector,
+    SparseChangeDetector,
+    score_seconds_digit,
+)
+from .gpx import GPXWriter
+from .stats import ParseStats
+from .text_format import (
+    LAYOUT_CLASSES,
+    EmbeddedData,
+    StateMachine,
+    embedded_data,
+    layouts,
+)
+
+# ffmpeg-python, pandas and Pillow are imported where they are used, to
+# keep the start up of the command line and worker processes short
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    import ffmpeg  # type: ignore[import-untyped]
+    import pandas as pd
+
+BAND_HEIGHT = 40
+# Rows of the band holding the text, from row 5 (v0) or 4 (v1)
+BAND_TEXT_HEIGHT = 30
+# Pixels either side of the expected offset of each character that are searched
+DEFAULT_OFFSET_SEARCH = 1
+# Pixels the whole band can be re-centered by when it drifts
+MAX_DRIFT = 4
+# With a temporal prior, the best score among a cell's likely letters that is
+# trusted without scoring the others
+PRIOR_MIN_SCORE = 0.9
+# Time and coordinate changes from the previous update beyond which a read
+# using the prior is implausible, and read again without it
+PRIOR_MAX_SECONDS = 5
+PRIOR_MAX_DEGREES_PER_SECOND = 0.001
+BAND_WIDTH = 1450
+BAND_Y = 1035
+# ~8.5s of 30fps footage, or ~45 MB of RGB frames per chunk
+DEFAULT_CHUNK_SIZE = 256
+DECODE_MODES = ("threshold", "gray", "monob")
+# Limited range luma of white, as produced by ffmpeg's white color source
+WHITE_LUMA = 235
+# v0 and v1 (shifted one pixel up) formats
+Y_OFFSETS = (0, -1)
+# Frames probed to choose the y offset, before falling back to the first chunk
+PROBE_FRAMES = 32
+# Mean best score of the seconds digit that the chosen y offset must reach, and
+# its lead over the other offset; the wrong offset scores ~0.75 on clean footage
+PROBE_MIN_SCORE = 0.85
+PROBE_MIN_MARGIN = 0.1
+# `fast_parse` arguments that do not change the parse results
+UNCACHED_ARGUMENTS = (
+    "output_directory",
+    "write_stacked_frames",
+    "chunk_size",
+    "glyph_memo",
+    "incremental",
+    "stats",
+    "ocr_threads",
+    "layouts",
+    "on_update",
+    "segments",
+    "band_directory",
+)
+# Consecutive updates OCR'd by each task when OCR is spread over threads, so
+# that incremental OCR still applies within a batch
+OCR_BATCH_SIZE = 8
+
+
+def _band_filter(mp4_path: str, **input_args: str) -> ffmpeg.nodes.FilterableStream:
+    import ffmpeg
+
+    trimmed = ffmpeg.input(mp4_path, **input_args).filter(
+        "crop", w=BAND_WIDTH, h=BAND_HEIGHT, x=0, y=BAND_Y
+    )
+    white = ffmpeg.input(f"color=white:s={BAND_WIDTH}x{BAND_HEIGHT}", f="lavfi")
+    black = ffmpeg.input(f"color=black:s={BAND_WIDTH}x{BAND_HEIGHT}", f="lavfi")
+    return ffmpeg.filter([trimmed, white, white, black], "threshold")
 
 
-def transcode(mp4_path: str) -> VIDEO_TYPE:
+def _band_output(
+    mp4_path: str,
+    decode: str,
+    skip_nonref: bool,
+    output: str = "pipe:",
+    start: Optional[float] = None,
+    frames: Optional[int] = None,
+) -> ffmpeg.nodes.OutputStream:
     """
-    Transcode an MP4 video file to extract the region with data.
+    Build the ffmpeg graph writing the thresholded data band to stdout, or to
+    `output`, in the pixel format of the `decode` mode.
 
-    Currently assumes 1080p video.
+    Decoding seeks to `start` seconds, if given, and stops after `frames`.
     """
-    height = 40
-    width = 1450
-    mp4 = ffmpeg.input(mp4_path)
-    trimmed = mp4.filter("crop", w=width, h=height, x=0, y=1035)
-    white = ffmpeg.input(f"color=white:s={width}x{height}", f="lavfi")
-    black = ffmpeg.input(f"color=black:s={width}x{height}", f="lavfi")
-    out, _ = (
-        ffmpeg.filter([trimmed, white, white, black], "threshold")
-        .output("pipe:", format="rawvideo", pix_fmt="rgb24")
-        .run(capture_stdout=True, quiet=True)
+    import ffmpeg
+
+    input_args: Dict[str, Any] = {"skip_frame": "noref"} if skip_nonref else {}
+    # Fill in skipped frames so that frame indexes stay close to the source
+    output_args: Dict[str, Any] = {"fps_mode": "cfr"} if skip_nonref else {}
+    if start is not None:
+        input_args["ss"] = start
+        # Rather than repeating the first frame to start from 0
+        output_args["fps_mode"] = "passthrough"
+    if frames is not None:
+        output_args["frames:v"] = frames
+    if decode == "threshold":
+        band = _band_filter(mp4_path, **input_args)
+        return band.output(output, format="rawvideo", pix_fmt="rgb24", **output_args)
+    band = (
+        ffmpeg.input(mp4_path, **input_args)
+        .filter("crop", w=BAND_WIDTH, h=BAND_HEIGHT, x=0, y=BAND_Y)
+        .filter("extractplanes", "y")
+        .filter("lut", c0=f"if(gt(val,{WHITE_LUMA}),0,255)")
     )
-    return np.frombuffer(out, np.uint8).reshape([-1, height, width, 3])
+    return band.output(output, format="rawvideo", pix_fmt=decode, **output_args)
 
 
-def fast_parse(
-    mp4_path: str, write_stacked_frames: bool = False, output_directory: str = ""
-) -> Tuple[dict[int, EmbeddedData], pd.Series[float]]:
-    alphabet = NUMBERS
+def _frame_shape(decode: str) -> Tuple[int, ...]:
+    if decode not in DECODE_MODES:
+        raise ValueError(f"Unknown decode mode: {decode}")
+    return {
+        "threshold": (BAND_HEIGHT, BAND_WIDTH, 3),
+        "gray": (BAND_HEIGHT, BAND_WIDTH),
+        "monob": (BAND_HEIGHT, (BAND_WIDTH + 7) // 8),
+    }[decode]
+
+
+def _read_chunks(
+    file: IO[bytes], chunk_size: int, decode: str, stats: Optional[ParseStats]
+) -> Iterator[BOOL_VIDEO_TYPE]:
+    """
+    Read the raw frames of `_band_output` until the end of `file`, yielding
+    them as boolean ink frames in chunks of at most `chunk_size` frames.
+    """
+    frame_shape = _frame_shape(decode)
+    frame_size = int(np.prod(frame_shape))
+    while True:
+        buffer = file.read(frame_size * chunk_size)
+        frame_count = len(buffer) // frame_size
+        if frame_count == 0:
+            return
+        if stats is not None:
+            stats.count("bytes_read", len(buffer))
+            stats.count("frames_decoded", frame_count)
+        video = np.frombuffer(buffer, np.uint8, count=frame_count * frame_size).reshape(
+            [frame_count, *frame_shape]
+        )
+        if decode == "threshold":
+            yield to_ink(video)
+        elif decode == "gray":
+            yield video < 128
+        else:
+            yield np.unpackbits(video, axis=-1, count=BAND_WIDTH) == 0
+
+
+def probe_frames(mp4_path: str) -> Tuple[int, float]:
+    """
+    Return the number of frames and the frame rate of a video.
+    """
+    import ffmpeg
+
+    probe = ffmpeg.probe(mp4_path, select_streams="v:0")
+    stream = probe["streams"][0]
+    numerator, denominator = stream["avg_frame_rate"].split("/")
+    frame_rate = int(numerator) / int(denominator)
+    if "nb_frames" in stream:
+        return int(stream["nb_frames"]), frame_rate
+    return round(float(probe["format"]["duration"]) * frame_rate), frame_rate
+
+
+def segment_starts(frame_count: int, segments: int) -> List[int]:
+    """
+    First frame of each of (at most) `segments` ranges of similar length.
+    """
+    segments = max(1, min(segments, frame_count))
+    return [i * frame_count // segments for i in range(segments)]
+
+
+def stream_video(
+    mp4_path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    decode: str = "threshold",
+    skip_nonref: bool = False,
+    stats: Optional[ParseStats] = None,
+    segments: int = 1,
+) -> Iterator[BOOL_VIDEO_TYPE]:
+    """
+    Decode the data band of an MP4 video file, yielding boolean ink frames in
+    chunks of at most `chunk_size` frames as they are read from the ffmpeg pipe.
+
+    Only a single chunk is held in memory at a time. `decode` selects the
+    ffmpeg output:
+
+     - threshold: RGB frames of the band thresholded against white
+     - gray: the luma plane only, thresholded with a lookup table
+     - monob: as gray, packed to 1 bit per pixel before leaving ffmpeg
 
-    video = transcode(mp4_path)
+    `skip_nonref` skips decoding non-reference frames and has ffmpeg repeat
+    frames to keep the source frame rate. Update boundaries, and so frame
+    indexes, can then be off by a frame or two, but ~30 frames are still stacked
+    per update.
 
-    start_time = datetime.now(timezone.utc)
+    With `segments > 1` (gray and monob only), the video is split into that many
+    ranges of frames, decoded in parallel by ffmpeg processes seeking to the
+    start of each range. The first range is streamed from its pipe while the
+    others are written to temporary files (~7 KB per frame with monob, ~58 KB
+    with gray), which are read in turn once the previous range is done. The
+    frames are the same as those of a single process, so updates straddling
+    ranges are detected and stacked as usual.
 
-    y_offsets = {0: StateMachine(), -1: StateMachine(True)}
-    seconds_digit_video: Dict[int, FLOAT_VIDEO_TYPE] = {
-        y_offset: 1
-        - (
-            video[:, (5 + y_offset) : (35 + y_offset), 561 : 561 + NUMBERS_SHAPE[1]]
-            / 255.0
+    The bytes and frames read, and the CPU time of ffmpeg, are added to `stats`.
+    The latter includes other ffmpeg processes finishing in the meantime.
+    """
+    import ffmpeg
+
+    _frame_shape(decode)
+    if segments > 1 and (decode == "threshold" or skip_nonref):
+        # Neither keeps frames aligned with the source after seeking
+        raise ValueError(
+            "Segmented decoding requires the gray or monob decode mode, without "
+            "skipping non-reference frames"
+        )
+    starts = [0]
+    if segments > 1:
+        frame_count, frame_rate = probe_frames(mp4_path)
+        starts = segment_starts(frame_count, segments)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = (
+        _band_output(
+            mp4_path,
+            decode,
+            skip_nonref,
+            frames=starts[1] if len(starts) > 1 else None,
         )
-        for y_offset in y_offsets
-    }
+        .global_args("-loglevel", "error", "-nostats")
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    directory = tempfile.mkdtemp(prefix="rct2gpx-") if len(starts) > 1 else None
+    segment_processes: List[Tuple[subprocess.Popen[bytes], str]] = []
+    try:
+        for i, start in enumerate(starts[1:], 1):
+            assert directory is not None
+            path = os.path.join(directory, f"{i}.raw")
+            # Seeking half a frame early lands on the range's first frame
+            segment = _band_output(
+                mp4_path,
+                decode,
+                skip_nonref,
+                path,
+                (start - 0.5) / frame_rate,
+                starts[i + 1] - start if i + 1 < len(starts) else None,
+            ).global_args("-loglevel", "error", "-nostats", "-y")
+            with open(f"{path}.log", "wb") as log:
+                segment_processes.append(
+                    (subprocess.Popen(segment.compile(), stderr=log), path)
+                )
 
-    change_scores: Dict[
-        int, Dict[str, np.ndarray[Tuple[int], np.dtype[np.float32]]]
-    ] = {}
-    best_average = 0.0
-    change_df = pd.DataFrame()
-    selected_y = 0
-    for y in y_offsets:
-        change_scores[y] = {}
-        for letter in alphabet:
-            change_scores[y][letter] = alphabet[letter].score_video(
-                seconds_digit_video[y]
+        yield from _read_chunks(process.stdout, chunk_size, decode, stats)
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise ffmpeg.Error("ffmpeg", None, stderr)
+        for segment_process, path in segment_processes:
+            if segment_process.wait() != 0:
+                with open(f"{path}.log", "rb") as log:
+                    raise ffmpeg.Error("ffmpeg", None, log.read())
+            with open(path, "rb") as file:
+                yield from _read_chunks(file, chunk_size, decode, stats)
+            os.unlink(path)
+    finally:
+        for segment_process, _ in segment_processes:
+            if segment_process.poll() is None:
+                segment_process.kill()
+            segment_process.wait()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+        # An early exit from the generator closes the pipe under ffmpeg, so
+        # failures are only reported above, once all of its output was read
+        process.stdout.close()
+        process.stderr.read()
+        process.stderr.close()
+        process.wait()
+        if stats is not None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            stats.add_time(
+                "ffmpeg",
+                0.0,
+                usage.ru_utime
+                + usage.ru_stime
+                - children_usage.ru_utime
+                - children_usage.ru_stime,
+            )
+
+
+def _band_metadata(mp4_path: str, decode: str, skip_nonref: bool) -> Dict[str, Any]:
+    stat = os.stat(mp4_path)
+    return dict(
+        x=0,
+        y=BAND_Y,
+        decode=decode,
+        skip_nonref=skip_nonref,
+        source_size=stat.st_size,
+        source_mtime_ns=stat.st_mtime_ns,
+    )
+
+
+def saved_band(
+    mp4_path: str, band_directory: str, decode: str, skip_nonref: bool
+) -> Optional[str]:
+    """
+    Path of the band file of a video in `band_directory`, if one was saved from
+    the current file with the same decode options.
+    """
+    path = band_path(band_directory, mp4_path)
+    header = read_header(path)
+    if header is None or (header["height"], header["width"]) != (
+        BAND_HEIGHT,
+        BAND_WIDTH,
+    ):
+        return None
+    metadata = _band_metadata(mp4_path, decode, skip_nonref)
+    if any(header.get(key) != value for key, value in metadata.items()):
+        return None
+    return path
+
+
+def read_band(
+    mp4_path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    band_directory: Optional[str] = None,
+    decode: str = "threshold",
+    skip_nonref: bool = False,
+) -> Optional[Iterator[BOOL_VIDEO_TYPE]]:
+    """
+    Chunks of the band file given as `mp4_path`, or of the band saved for the
+    video in `band_directory`, or None if the video must be decoded.
+    """
+    if mp4_path.endswith(BAND_EXTENSION):
+        return stream_band(mp4_path, chunk_size)
+    if band_directory is not None:
+        saved = saved_band(mp4_path, band_directory, decode, skip_nonref)
+        if saved is not None:
+            return stream_band(saved, chunk_size)
+    return None
+
+
+def to_ink(video: VIDEO_TYPE) -> BOOL_VIDEO_TYPE:
+    """
+    Convert thresholded RGB frames (black text on white) to single channel
+    boolean ink frames.
+    """
+    return video[..., 0] < 128
+
+
+class _LayoutTable:
+    """
+    Character cells of every layout of the state machine (see `layouts`), as
+    indexes into the distinct x offsets of the cells, which are all scored at
+    once for each update.
+    """
+
+    def __init__(self, use_parity: bool) -> None:
+        table = layouts(use_parity)
+        self.offsets = np.array(sorted({x for layout in table for x in layout.offsets}))
+        self.windows = np.searchsorted(
+            self.offsets, np.array([layout.offsets for layout in table])
+        )
+        self.classes = np.array([layout.classes for layout in table])
+        # Digits at the same offset in every layout, i.e. the date, which the
+        # drift is measured on
+        fixed = (self.windows == self.windows[0]).all(axis=0) & (
+            self.classes == LAYOUT_CLASSES.index("0")
+        ).all(axis=0)
+        self.anchors = self.windows[0, fixed]
+
+
+@cache
+def _layout_table(use_parity: bool) -> _LayoutTable:
+    return _LayoutTable(use_parity)
+
+
+class _CandidateMasks:
+    """
+    Masks of the candidate letters of a character, zero-padded to the widest
+    one, to score cells at every shift of a small window at once.
+    """
+
+    def __init__(self, alphabet: Dict[str, Character]) -> None:
+        self.letters = tuple(alphabet)
+        self.widths = np.array([CHAR_WIDTHS[letter] for letter in alphabet])
+        self.width = int(self.widths.max())
+        masks = np.zeros((len(alphabet), BAND_TEXT_HEIGHT, self.width), dtype=np.bool_)
+        self.fixed_scores: Dict[int, float] = {}
+        for i, (letter, character) in enumerate(alphabet.items()):
+            if isinstance(character, FixedScore):
+                self.fixed_scores[i] = character.score
+            else:
+                masks[i, :, : CHAR_WIDTHS[letter]] = character.mask
+        self.masks = masks.reshape(len(alphabet), -1).astype(np.float64)
+        self.sizes = self.masks.sum(axis=1)
+
+    def score(
+        self, windows: np.ndarray[Tuple[int, int, int], np.dtype[np.uint8]]
+    ) -> np.ndarray[Tuple[int, int, int], np.dtype[np.float64]]:
+        """
+        Score every letter at every shift of `[N, height, width]` windows wider
+        than the letters, returning a `[N, shifts, letters]` array.
+
+        Scores are those of `Character.score_frame` for the cell at each shift.
+        """
+        count = len(windows)
+        shifts = windows.shape[2] - self.width + 1
+        cells = self._cells(windows).reshape(count * shifts, -1)
+        intersection = (cells @ self.masks.T).reshape(count, shifts, -1)
+        overlap = ((cells != 0) @ self.masks.T).reshape(count, shifts, -1)
+        columns = self._columns(windows)
+        starts = np.arange(shifts)[:, None]
+        ink = columns[:, starts + self.widths] - columns[:, starts]
+        union = self.sizes + ink - overlap
+        # Only the fixed scores, overwritten below, can have an empty union
+        scores = np.divide(
+            intersection / 255, union, out=np.zeros_like(intersection), where=union > 0
+        )
+        for i, score in self.fixed_scores.items():
+            scores[:, :, i] = score
+        return scores  # type: ignore[no-any-return]
+
+    def score_candidates(
+        self,
+        windows: np.ndarray[Tuple[int, int, int], np.dtype[np.uint8]],
+        candidates: np.ndarray[Tuple[int, int], np.dtype[np.intp]],
+    ) -> np.ndarray[Tuple[int, int, int], np.dtype[np.float64]]:
+        """
+        Score only the `[N, candidates]` letter indexes of each window, which
+        must not have fixed scores, returning a `[N, shifts, candidates]` array
+        of the scores `score` would give them.
+        """
+        count = len(windows)
+        shifts = windows.shape[2] - self.width + 1
+        cells = self._cells(windows)
+        masks = self.masks[candidates].transpose(0, 2, 1)
+        intersection = cells @ masks
+        overlap = (cells != 0) @ masks
+        columns = self._columns(windows)
+        ends = np.arange(shifts)[None, :, None] + self.widths[candidates][:, None, :]
+        ink = np.take_along_axis(
+            columns, ends.reshape(count, shifts * candidates.shape[1]), axis=1
+        )
+        ink = ink.reshape(ends.shape) - columns[:, :shifts, None]
+        union = self.sizes[candidates][:, None, :] + ink - overlap
+        return np.divide(  # type: ignore[no-any-return]
+            intersection / 255, union, out=np.zeros_like(intersection), where=union > 0
+        )
+
+    def _cells(
+        self, windows: np.ndarray[Tuple[int, int, int], np.dtype[np.uint8]]
+    ) -> np.ndarray[Tuple[int, int, int], np.dtype[np.uint8]]:
+        # `[N, shifts, height * width]` cells at every shift of the windows
+        cells = sliding_window_view(windows, self.width, axis=2)
+        shape = (len(windows), cells.shape[2], windows.shape[1] * self.width)
+        return cells.transpose(0, 2, 1, 3).reshape(shape)
+
+    @staticmethod
+    def _columns(
+        windows: np.ndarray[Tuple[int, int, int], np.dtype[np.uint8]],
+    ) -> np.ndarray[Tuple[int, int], np.dtype[np.int64]]:
+        # Cumulative inked pixels of each window's columns, from which the ink
+        # of each cell within each letter's width follows
+        columns = np.zeros((len(windows), windows.shape[2] + 1), dtype=np.int64)
+        np.cumsum(np.count_nonzero(windows, axis=1), axis=1, out=columns[:, 1:])
+        return columns
+
+
+@cache
+def _candidate_masks() -> _CandidateMasks:
+    return _CandidateMasks(NEGATIVE_OR_NUMBER)
+
+
+@cache
+def _prior_candidates() -> np.ndarray[Tuple[int, int], np.dtype[np.intp]]:
+    """
+    Letters a cell is likely to read given the letter it read in the previous
+    update, as a `[letters, candidates]` array of letter indexes: a digit is
+    most likely followed by the next one (counters), itself, the one after or
+    the one before (coordinates), or a negative sign. A negative sign is only
+    followed by itself. Fixed scores have no candidates.
+    """
+    letters = _candidate_masks().letters
+    negative = letters.index("-")
+    candidates = np.full((len(letters), 5), negative)
+    for i, letter in enumerate(letters):
+        if letter.isdigit():
+            digit = int(letter)
+            candidates[i, :4] = [
+                letters.index(str((digit + step) % 10)) for step in (1, 0, 2, -1)
+            ]
+    return candidates
+
+
+def _plausible(previous: EmbeddedData, data: EmbeddedData) -> bool:
+    """
+    Whether `data` can follow `previous`: time moves forward by at most
+    `PRIOR_MAX_SECONDS`, and coordinates by at most
+    `PRIOR_MAX_DEGREES_PER_SECOND` per second.
+    """
+    elapsed = (data["datetime"] - previous["datetime"]).total_seconds()
+    if not 0 <= elapsed <= PRIOR_MAX_SECONDS:
+        return False
+    for field in ("latitude", "longitude"):
+        before, after = previous[field], data[field]
+        if before is None or after is None:
+            continue
+        if abs(float(after - before)) > PRIOR_MAX_DEGREES_PER_SECOND * max(elapsed, 1):
+            return False
+    return True
+
+
+class StackedFrameReader:
+    """
+    OCRs the stacked frames of a video's updates in order.
+
+    Every character cell of every layout the state machine can read is scored
+    at once, and the layout with the highest total score is read, rather than
+    following the state machine one character at a time.
+
+    Cell scores are looked up in and added to `glyph_memo`, if given. With
+    `incremental`, the stacked frame is diffed against the previous update's,
+    and cells whose pixels are unchanged reuse the previous update's scores
+    instead of being scored again. Typically only the last digits of each field
+    change.
+
+    With `temporal_prior`, the changed cells of the previous update's digits and
+    negative signs are only scored against the letters likely to follow (see
+    `_prior_candidates`), unless none of them scores `PRIOR_MIN_SCORE`. Changed
+    cells outside the previous update's layout are scored against every letter,
+    so a change of layout is still read. If the data read is not a plausible successor of the previous update, the
+    pruned cells are scored against every letter and the update is read again.
+    """
+
+    def __init__(
+        self,
+        state_machine: StateMachine,
+        y_offset: int,
+        glyph_memo: Optional[GlyphMemo] = None,
+        incremental: bool = True,
+        offset_search: int = DEFAULT_OFFSET_SEARCH,
+        temporal_prior: bool = False,
+    ) -> None:
+        self.state_machine = state_machine
+        self.y_offset = y_offset
+        self.glyph_memo = glyph_memo
+        self.incremental = incremental
+        self.offset_search = offset_search
+        self.temporal_prior = temporal_prior
+        self.table = _layout_table(state_machine.use_parity)
+        self.candidates = _candidate_masks()
+        # Shift of the whole band from the state machine's offsets
+        self.drift = 0
+        self.previous_band: Optional[INK_FRAME_TYPE] = None
+        self.previous_scores: Optional[np.ndarray[Any, np.dtype[np.float64]]] = None
+        self.previous_drift = 0
+        # Letter index read by each window in the previous update, or -1
+        self.prior = np.full(len(self.table.offsets), -1)
+        self.previous_data: Optional[EmbeddedData] = None
+        # Windows of `previous_scores` only scored against their candidates
+        self.pruned_windows = np.zeros(len(self.table.offsets), dtype=np.bool_)
+        self.scored = 0
+        self.reused = 0
+        self.pruned = 0
+        self.rejected = 0
+
+    def clone(self) -> StackedFrameReader:
+        """
+        A reader with the same settings and a state machine of its own, with no
+        previous update.
+        """
+        return StackedFrameReader(
+            StateMachine(use_parity=self.state_machine.use_parity),
+            self.y_offset,
+            self.glyph_memo,
+            self.incremental,
+            self.offset_search,
+            self.temporal_prior,
+        )
+
+    def _score_windows(
+        self, band: INK_FRAME_TYPE, use_prior: bool
+    ) -> np.ndarray[Tuple[int, int, int], np.dtype[np.float64]]:
+        """
+        Score the window of every distinct cell offset, `offset_search` pixels
+        wider on each side than the cell, returning a `[cells, shifts, letters]`
+        array. With `use_prior`, changed windows may only be scored against the
+        candidates of their prior letter, or not at all, see `_score_prior`.
+        """
+        search = self.offset_search
+        width = self.candidates.width + 2 * search
+        starts = self.table.offsets + (self.drift + MAX_DRIFT)
+        pending = np.arange(len(starts))
+        scores: Optional[np.ndarray[Any, np.dtype[np.float64]]] = None
+        if (
+            self.incremental
+            and self.previous_band is not None
+            and self.previous_scores is not None
+            and self.previous_drift == self.drift
+        ):
+            changed = np.concatenate(
+                [[0], np.cumsum((band != self.previous_band).any(axis=0))]
+            )
+            pending = np.flatnonzero(changed[starts + width] > changed[starts])
+            if not use_prior:
+                pending = np.union1d(pending, np.flatnonzero(self.pruned_windows))
+            scores = self.previous_scores.copy()
+            pruned = self.pruned_windows.copy()
+            self.reused += len(starts) - len(pending)
+        else:
+            pruned = np.zeros(len(starts), dtype=np.bool_)
+        pruned[pending] = False
+        self.pruned_windows = pruned
+        self.scored += len(pending)
+
+        windows = band[:, starts[pending, None] + np.arange(width)].transpose(1, 0, 2)
+        keys: List[Hashable] = []
+        if self.glyph_memo is not None:
+            keys = [GlyphMemo.key(self.candidates.letters, w) for w in windows]
+            memoized = [self.glyph_memo.get(key) for key in keys]
+            misses = [i for i, hit in enumerate(memoized) if hit is None]
+        else:
+            misses = list(range(len(pending)))
+        if scores is None:
+            scores = np.empty(
+                (len(starts), 2 * search + 1, len(self.candidates.letters))
             )
+        if self.glyph_memo is not None:
+            for i, hit in enumerate(memoized):
+                if hit is not None:
+                    scores[pending[i]] = hit
+        if use_prior and misses:
+            misses = self._score_prior(windows, pending, misses, scores)
+        if not misses:
+            return scores
+        new_scores = self.candidates.score(windows[misses])
+        if self.glyph_memo is not None:
+            for i, cell_scores in zip(misses, new_scores):
+                self.glyph_memo.put(keys[i], cell_scores)
+        scores[pending[misses]] = new_scores
+        return scores
+
+    def _score_prior(
+        self,
+        windows: np.ndarray[Tuple[int, int, int], np.dtype[np.uint8]],
+        pending: np.ndarray[Tuple[int], np.dtype[np.intp]],
+        misses: List[int],
+        scores: np.ndarray[Tuple[int, int, int], np.dtype[np.float64]],
+    ) -> List[int]:
+        """
+        Score the `misses` of `windows` with a prior letter against its
+        candidates. Returns the misses left to score against every letter:
+        those without a prior letter, which are read if the layout changed, and
+        those whose candidates all score below `PRIOR_MIN_SCORE`.
+
+        Pruned scores are incomplete, so they are not memoized.
+        """
+        known = np.array(
+            [i for i in misses if self.prior[pending[i]] >= 0], dtype=np.intp
+        )
+        candidates = _prior_candidates()[self.prior[pending[known]]]
+        candidate_scores = self.candidates.score_candidates(windows[known], candidates)
+        confident = candidate_scores.max(axis=(1, 2)) >= PRIOR_MIN_SCORE
+        cells = pending[known[confident]]
+        scores[cells] = 0
+        rows = np.arange(scores.shape[1])[None, :, None]
+        scores[cells[:, None, None], rows, candidates[confident][:, None, :]] = (
+            candidate_scores[confident]
+        )
+        self.pruned_windows[cells] = True
+        self.pruned += len(cells)
+        pruned = set(known[confident].tolist())
+        return [i for i in misses if i not in pruned]
+
+    def read(self, stacked_frame: INK_FRAME_TYPE) -> Tuple[EmbeddedData, float]:
+        """
+        OCR a stacked frame, returning the embedded data and the mean score of
+        the selected characters.
+
+        Each character is matched up to `offset_search` pixels either side of
+        its offset. When the date digits are mostly matched off-center, the
+        band is assumed to have drifted and is scored again, re-centered by up
+        to `MAX_DRIFT` pixels.
+        """
+        search = self.offset_search
+        band = stacked_frame[(5 + self.y_offset) : (35 + self.y_offset)]
+        # Band coordinates are shifted so windows never go out of the band
+        band = np.pad(band, ((0, 0), (MAX_DRIFT + search, MAX_DRIFT + search)))
+        previous = self.previous_data if self.temporal_prior else None
+        if previous is not None:
+            try:
+                data, score = self._read_band(band, True)
+                if _plausible(previous, data):
+                    self.previous_data = data
+                    return data, score
+            except ValueError:
+                pass
+            self.rejected += 1
+        try:
+            data, score = self._read_band(band, False)
+        except ValueError:
+            self.prior[:] = -1
+            self.previous_data = None
+            raise
+        self.previous_data = data
+        return data, score
 
-        current_df = pd.DataFrame(change_scores[y])
-        current_average = current_df.max(axis=1).mean()
+    def _read_band(
+        self, band: INK_FRAME_TYPE, use_prior: bool
+    ) -> Tuple[EmbeddedData, float]:
+        table = self.table
+        search = self.offset_search
+        letters = self.candidates.letters
+        digits = [i for i, letter in enumerate(letters) if letter.isdigit()]
+        negative = letters.index("-")
+        # Rows ordered by distance from the expected offset: 0, -1, +1, ...
+        order = sorted(range(2 * search + 1), key=lambda row: abs(row - search))
+
+        tried = {self.drift}
+        while True:
+            scores = self._score_windows(band, use_prior)
+            self.previous_band, self.previous_scores = band, scores
+            self.previous_drift = self.drift
+            ordered = scores[:, order]
+            # Best digit of each cell; ties go to the smallest shift, then to
+            # the first letter
+            flat_digits = ordered[:, :, digits].reshape(len(scores), -1)
+            best_digit = flat_digits.argmax(axis=1)
+            digit_shifts = np.array(order)[best_digit // len(digits)] - search
+            if search == 0:
+                break
+            drift = self.drift + int(np.median(digit_shifts[table.anchors]))
+            drift = int(np.clip(drift, -MAX_DRIFT, MAX_DRIFT))
+            if drift in tried:
+                break
+            tried.add(drift)
+            self.drift = drift
+
+        class_scores = np.empty((len(LAYOUT_CLASSES), len(scores)))
+        class_scores[0] = flat_digits[np.arange(len(scores)), best_digit]
+        class_scores[1] = ordered[:, :, negative].max(axis=1)
+        class_scores[2] = NEGATIVE_OR_NUMBER[" "].score_frame(band)
+        class_scores[3] = NEGATIVE_OR_NOTHING[""].score_frame(band)
+        totals = class_scores[table.classes, table.windows].sum(axis=1)
+        layout = int(totals.argmax())
+        windows, classes = table.windows[layout], table.classes[layout]
+        cell_scores = class_scores[classes, windows]
+
+        chars = []
+        self.prior[:] = -1
+        for window, cls, score in zip(windows, classes, cell_scores):
+            if cls == 0:
+                letter = digits[best_digit[window] % len(digits)]
+            elif cls == 1:
+                letter = negative
+            else:
+                chars.append(LAYOUT_CLASSES[cls] if score > 0 else "")
+                continue
+            if score > 0:
+                self.prior[window] = letter
+            chars.append(letters[letter] if score > 0 else "")
+        return embedded_data(chars), float(cell_scores.mean())
+
+
+class _Update:
+    """
+    Running count of the inked frames at each pixel for a single data update.
+
+    Only every `stride`-th frame of the update is counted. Frames are added in
+    place to a single buffer, which can be handed over from the previous update
+    once its stacked frame is taken.
+    """
+
+    def __init__(
+        self,
+        frame_index: int,
+        score: float,
+        stride: int = 1,
+        total: Optional[np.ndarray[Any, np.dtype[np.int32]]] = None,
+    ) -> None:
+        self.frame_index = frame_index
+        self.score = score
+        self.stride = stride
+        if total is not None:
+            total.fill(0)
+        self.total = total
+        self.count = 0
+
+    def add(self, ink: BOOL_VIDEO_TYPE, frame_index: int) -> None:
+        """
+        Add frames starting at `frame_index` to the update.
+        """
+        ink = ink[(self.frame_index - frame_index) % self.stride :: self.stride]
+        if len(ink) == 0:
+            return
+        if self.total is None or self.total.shape != ink.shape[1:]:
+            self.total = np.zeros(ink.shape[1:], dtype=np.int32)
+        for frame in ink:
+            np.add(self.total, frame, out=self.total)
+        self.count += len(ink)
+
+    def stacked_frame(self) -> INK_FRAME_TYPE:
+        """
+        The fraction of frames with ink at each pixel, scaled to 0-255.
+
+        The running count is scaled in place, so this can only be called once.
+        """
+        assert self.total is not None and self.count > 0
+        self.total *= 255
+        self.total += self.count // 2
+        stacked_frame = np.empty(self.total.shape, dtype=np.uint8)
+        np.floor_divide(self.total, self.count, out=stacked_frame, casting="unsafe")
+        self.count = 0
+        return stacked_frame
+
+
+@cache
+def _ocr_executor(threads: int) -> ThreadPoolExecutor:
+    from concurrent.futures import ThreadPoolExecutor
+
+    return ThreadPoolExecutor(threads, thread_name_prefix="ocr")
+
+
+def _read_batch(
+    reader: StackedFrameReader, stacked_frames: List[INK_FRAME_TYPE]
+) -> Tuple[List[Tuple[EmbeddedData, float]], float, float]:
+    """
+    OCR consecutive stacked frames, also returning the wall and CPU time taken.
+    """
+    wall, cpu = time.perf_counter(), time.thread_time()
+    reads = [reader.read(stacked_frame) for stacked_frame in stacked_frames]
+    return reads, time.perf_counter() - wall, time.thread_time() - cpu
+
+
+def _mean_best_score(ink: BOOL_VIDEO_TYPE, y_offset: int) -> float:
+    return float(score_seconds_digit(ink, y_offset).max(axis=1).mean())
+
+
+def probe_y_offset(
+    ink: BOOL_VIDEO_TYPE, expected: Optional[int] = None
+) -> Optional[int]:
+    """
+    Choose the y offset from the first `PROBE_FRAMES` frames, or return None if
+    neither offset is a confident match.
+
+    An `expected` offset, e.g. that of the previous video from the same device,
+    is only checked against `PROBE_MIN_SCORE`, without scoring the other one.
+    """
+    probe = ink[:PROBE_FRAMES]
+    if expected is not None and _mean_best_score(probe, expected) >= PROBE_MIN_SCORE:
+        return expected
+    scores = sorted((_mean_best_score(probe, y), y) for y in Y_OFFSETS)
+    (runner_up, _), (best, selected_y) = scores[-2:]
+    if best >= PROBE_MIN_SCORE and best - runner_up >= PROBE_MIN_MARGIN:
+        return selected_y
+    return None
+
+
+def select_y_offset(ink: BOOL_VIDEO_TYPE, expected: Optional[int] = None) -> int:
+    """
+    Choose between the v0 (0) and v1 (-1) y offsets by the mean best score of
+    the seconds digit.
+
+    Only the first frames are scored, unless they are inconclusive (e.g. the
+    overlay is not shown yet), in which case every frame of `ink` is.
+    """
+    selected_y = probe_y_offset(ink, expected)
+    if selected_y is not None:
+        return selected_y
+    best_average = -1.0
+    selected_y = 0
+    for y in Y_OFFSETS:
+        current_average = _mean_best_score(ink, y)
         if current_average > best_average:
-            change_df = current_df
             best_average = current_average
             selected_y = y
+    return selected_y
+
+
+def fast_parse(
+    mp4_path: str,
+    write_stacked_frames: bool = False,
+    output_directory: str = "",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    decode: str = "threshold",
+    skip_nonref: bool = False,
+    sample_step: int = 1,
+    stack_step: int = 1,
+    pixel_diff: bool = True,
+    glyph_memo: Optional[GlyphMemo] = None,
+    incremental: bool = True,
+    stats: Optional[ParseStats] = None,
+    reader: Optional[StackedFrameReader] = None,
+    chunks: Optional[Iterator[BOOL_VIDEO_TYPE]] = None,
+    ocr_threads: int = 1,
+    layouts: Optional[LayoutCache] = None,
+    on_update: Optional[Callable[[int, EmbeddedData, float], None]] = None,
+    offset_search: int = DEFAULT_OFFSET_SEARCH,
+    temporal_prior: bool = False,
+    segments: int = 1,
+    band_directory: Optional[str] = None,
+) -> Tuple[dict[int, EmbeddedData], pd.Series[float]]:
+    """
+    Extract the embedded data of an MP4 video file, returning the data and the
+    mean character score of each update, keyed by the update's first frame.
 
-    best_fit = change_df.idxmax(axis=1)
+    With `sample_step > 1` only every `sample_step`-th frame is scored to find
+    data updates (see `SparseChangeDetector`), and with `stack_step > 1` only
+    every `stack_step`-th frame of an update is stacked. Otherwise, with
+    `pixel_diff`, only frames whose seconds digit changed by a few pixels are
+    scored (see `DiffChangeDetector`).
 
-    changes = best_fit[best_fit != best_fit.shift(1)].index
-    change_max = change_df.max(axis=1)
+    Character matches are memoized across the updates of the video, and across
+    videos if a shared `glyph_memo` is given. With `incremental`, characters
+    are only scored again when their cell changed since the previous update, and
+    are searched for up to `offset_search` pixels from their expected offset,
+    and with `temporal_prior` only scored against the letters likely to follow
+    the previous update's (see `StackedFrameReader`).
 
-    ranges: List[Tuple[int, int]] = []
-    for i in range(len(changes) - 1):
-        if change_max[i] > 0.8:
-            ranges.append((changes[i], changes[i + 1]))
-    ranges.append((changes[-1], len(video)))
+    The time spent in each stage and counters of the work done are added to
+    `stats`, if given.
 
-    stacked_frames: Dict[int, FLOAT_FRAME_TYPE] = {}
-    for r in ranges:
-        stacked_frames[r[0]] = video[r[0] : r[1]].mean(axis=0)
-        if write_stacked_frames:
-            path = os.path.join(output_directory, f"data_{r[0]}.png")
-            Image.fromarray(stacked_frames[r[0]].astype(np.uint8)).save(path)
+    A `reader` from a previous video can be given to carry its y offset and
+    incremental state over, e.g. for consecutive videos of a ride; it then takes
+    the place of `glyph_memo` and `incremental`. `chunks` replaces decoding the
+    video with `stream_video`, e.g. to start decoding ahead of time; otherwise
+    the video is decoded in `segments` parallel ranges (see `stream_video`).
+
+    With `band_directory`, the decoded band is saved there as a band file (see
+    `BandWriter`), which is memory-mapped rather than decoding the video again
+    on later calls with the same decode options. `mp4_path` can also be a band
+    file itself.
+
+    With `ocr_threads > 1`, batches of `OCR_BATCH_SIZE` consecutive updates are
+    OCR'd on a thread pool while the video is still being decoded, each batch
+    with its own clone of the reader. The reader's incremental state is then
+    not carried over between batches, or to the next video.
+
+    The y offset found is stored in `layouts`, if given, for the directory of
+    the video, and only checked rather than probed for the next videos there.
+
+    `on_update` is called with the frame index, data and score of each update
+    as soon as it is read, in order, e.g. to stream the output to disk.
+    """
+    import pandas as pd
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    if stats is None:
+        stats = ParseStats()
+    if reader is not None:
+        glyph_memo = reader.glyph_memo
+        scored, reused = reader.scored, reader.reused
+        pruned, rejected = reader.pruned, reader.rejected
+    else:
+        scored, reused, pruned, rejected = 0, 0, 0, 0
+    if glyph_memo is None:
+        glyph_memo = GlyphMemo()
+    memo_hits, memo_misses = glyph_memo.hits, glyph_memo.misses
 
     result: Dict[int, EmbeddedData] = {}
     summary_stats: Dict[int, float] = {}
-    state_machine = y_offsets[selected_y]
-    for frame_index, stacked_frame in stacked_frames.items():
-        chars: List[str] = []
-        best_scores: List[float] = []
-
-        while not state_machine.is_complete():
-            alphabet = state_machine.get_alphabet()
-            if alphabet == {}:
-                continue
-            offset = state_machine.get_next_offset()
-            offset_frame = {
-                width: (
-                    1
-                    - (
-                        stacked_frame[
-                            (5 + selected_y) : (35 + selected_y),
-                            offset : offset + width,
-                        ]
-                        / 255.0
+    batch: List[Tuple[int, INK_FRAME_TYPE]] = []
+    batches: List[
+        Tuple[
+            List[int],
+            StackedFrameReader,
+            Future[Tuple[List[Tuple[EmbeddedData, float]], float, float]],
+        ]
+    ] = []
+
+    def submit_batch() -> None:
+        assert reader is not None
+        batch_reader = reader.clone()
+        frame_indexes, stacked_frames = zip(*batch)
+        future = _ocr_executor(ocr_threads).submit(
+            _read_batch, batch_reader, list(stacked_frames)
+        )
+        batches.append((list(frame_indexes), batch_reader, future))
+        batch.clear()
+
+    def collect_batch() -> None:
+        assert stats is not None
+        frame_indexes, batch_reader, future = batches.pop(0)
+        reads, wall, cpu = future.result()
+        stats.add_time("ocr", wall, cpu)
+        for frame_index, (data, score) in zip(frame_indexes, reads):
+            result[frame_index], summary_stats[frame_index] = data, score
+            if on_update is not None:
+                on_update(frame_index, data, score)
+        stats.count("characters_scored", batch_reader.scored)
+        stats.count("characters_reused", batch_reader.reused)
+        stats.count("characters_pruned", batch_reader.pruned)
+        stats.count("prior_reads_rejected", batch_reader.rejected)
+
+    def finish(update: _Update) -> None:
+        assert reader is not None and stats is not None
+        with stats.stage("stack"):
+            stacked_frame = update.stacked_frame()
+        if write_stacked_frames:
+            with stats.stage("write_stacked_frames"):
+                from PIL import Image
+
+                path = os.path.join(output_directory, f"data_{update.frame_index}.png")
+                Image.fromarray(255 - stacked_frame).save(path)
+        if ocr_threads > 1:
+            batch.append((update.frame_index, stacked_frame))
+            if len(batch) == OCR_BATCH_SIZE:
+                submit_batch()
+            # Batches are reported in order, as soon as they are read
+            while batches and batches[0][2].done():
+                collect_batch()
+            return
+        with stats.stage("ocr"):
+            data, score = reader.read(stacked_frame)
+        result[update.frame_index], summary_stats[update.frame_index] = data, score
+        if on_update is not None:
+            on_update(update.frame_index, data, score)
+
+    # The y offset (v0 vs v1 format) is chosen from the first chunk so that
+    # each update can be OCR'd, and its frames released, as soon as the next
+    # data update is detected.
+    frame_count = 0
+    detector: Optional[ChangeDetector] = None
+    update: Optional[_Update] = None
+    if chunks is None:
+        chunks = read_band(mp4_path, chunk_size, band_directory, decode, skip_nonref)
+    if (
+        band_directory is not None
+        and not mp4_path.endswith(BAND_EXTENSION)
+        and saved_band(mp4_path, band_directory, decode, skip_nonref) is None
+    ):
+        if chunks is None:
+            chunks = stream_video(
+                mp4_path, chunk_size, decode, skip_nonref, stats, segments
+            )
+        os.makedirs(band_directory, exist_ok=True)
+        writer = BandWriter(
+            band_path(band_directory, mp4_path),
+            BAND_HEIGHT,
+            BAND_WIDTH,
+            **_band_metadata(mp4_path, decode, skip_nonref),
+        )
+        chunks = save_band(chunks, writer)
+    if chunks is None:
+        chunks = stream_video(
+            mp4_path, chunk_size, decode, skip_nonref, stats, segments
+        )
+    while True:
+        with stats.stage("decode"):
+            ink = next(chunks, None)
+        if ink is None:
+            break
+        if detector is None:
+            if reader is None:
+                directory = os.path.dirname(mp4_path)
+                with stats.stage("detect"):
+                    selected_y = select_y_offset(
+                        ink[::sample_step],
+                        layouts.get(directory) if layouts is not None else None,
                     )
+                if layouts is not None:
+                    layouts.put(directory, selected_y)
+                reader = StackedFrameReader(
+                    StateMachine(use_parity=selected_y != 0),
+                    selected_y,
+                    glyph_memo,
+                    incremental,
+                    offset_search,
+                    temporal_prior,
                 )
-                for width in set(CHAR_WIDTHS[x] for x in alphabet.keys())
-            }
-            scores = {
-                letter: alphabet[letter].score_frame(offset_frame[CHAR_WIDTHS[letter]])
-                for letter in alphabet
-            }
-            max_score = 0.0
-            max_letter = ""
-            for letter, score in scores.items():
-                if score > max_score:
-                    max_score = score
-                    max_letter = letter
+            if sample_step > 1:
+                detector = SparseChangeDetector(reader.y_offset, sample_step)
+            elif pixel_diff:
+                detector = DiffChangeDetector(reader.y_offset)
+            else:
+                detector = ChangeDetector(reader.y_offset)
 
-            state_machine.append(max_letter)
-            chars.append(max_letter)
-            best_scores.append(max_score)
+        with stats.stage("detect"):
+            changes = detector.detect(ink, frame_count)
+        stats.count("updates_detected", len(changes))
+        first_change = changes[0][0] - frame_count if changes else len(ink)
+        if first_change != 0:
+            assert update is not None
+            with stats.stage("stack"):
+                update.add(ink[:first_change], frame_count)
+        for i, (change, score) in enumerate(changes):
+            if update is not None and update.score > 0.8:
+                finish(update)
+            # Every update but the last is finished or dropped by now
+            update = _Update(
+                change, score, stack_step, update.total if update is not None else None
+            )
+            end = changes[i + 1][0] if i + 1 < len(changes) else frame_count + len(ink)
+            with stats.stage("stack"):
+                update.add(ink[change - frame_count : end - frame_count], change)
+
+        frame_count += len(ink)
 
-        result[int(frame_index)] = state_machine.result()
-        summary_stats[int(frame_index)] = pd.Series(best_scores).mean()
-        state_machine.reset()
+    if update is not None:
+        finish(update)
+    if batch:
+        submit_batch()
+    while batches:
+        collect_batch()
 
-    end_time = datetime.now(timezone.utc)
-    duration = (end_time - start_time).total_seconds()
-    logging.info(f"Parsed {len(video)} frames in {duration:.2f} seconds")
+    if detector is not None and reader is not None:
+        stats.count("frames_scored", detector.frames_scored)
+        stats.count("characters_scored", reader.scored - scored)
+        stats.count("characters_reused", reader.reused - reused)
+        stats.count("characters_pruned", reader.pruned - pruned)
+        stats.count("prior_reads_rejected", reader.rejected - rejected)
+    stats.count("updates_read", len(result))
+    stats.count("glyph_memo_hits", glyph_memo.hits - memo_hits)
+    stats.count("glyph_memo_misses", glyph_memo.misses - memo_misses)
+    stats.add_time(
+        "fast_parse",
+        time.perf_counter() - start_wall,
+        time.process_time() - start_cpu,
+    )
+    logging.info(
+        f"Parsed {frame_count} frames in {stats.wall['fast_parse']:.2f} seconds"
+    )
 
     return result, pd.Series(summary_stats)
 
 
+def find_videos(paths: Sequence[str]) -> List[str]:
+    """
+    Expand directories and glob patterns into a sorted list of MP4 files.
+
+    Explicitly listed files are kept in the order given.
+    """
+    videos: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = [
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.lower().endswith(".mp4")
+            ]
+        elif glob.has_magic(path):
+            matches = glob.glob(path)
+        else:
+            videos.append(path)
+            continue
+        if not matches:
+            logging.warning(f"No MP4 files found for {path}")
+        videos.extend(sorted(matches))
+    return videos
+
+
+def write_csv(result: Dict[int, EmbeddedData], csv_path: str) -> None:
+    import pandas as pd
+
+    df = pd.DataFrame.from_dict(result, orient="index")
+    df.index.name = "frame_index"
+    df.to_csv(csv_path)
+
+
+def write_gpx(results: Sequence[Dict[int, EmbeddedData]], gpx_path: str) -> None:
+    """
+    Write a GPX file with a single track and one segment per result.
+    """
+    with GPXWriter(gpx_path) as writer:
+        for result in results:
+            writer.new_segment()
+            for frame_index in sorted(result.keys()):
+                writer.add(result[frame_index])
+
+
+# Shared by the videos parsed in each process of a batch run
+_BATCH_GLYPH_MEMO = GlyphMemo()
+
+
+def _init_worker(level: int) -> None:
+    logging.basicConfig(level=level)
+
+
+def parse_key(mp4_path: str, **kwargs: Any) -> str:
+    """
+    Cache key of the results of `fast_parse(mp4_path, **kwargs)`: the
+    fingerprint of the file and the arguments affecting the results.
+    """
+    return fingerprint(
+        mp4_path,
+        **{k: v for k, v in kwargs.items() if k not in UNCACHED_ARGUMENTS},
+    )
+
+
+def cached_parse(
+    mp4_path: str, cache: ResultCache, **kwargs: Any
+) -> Tuple[dict[int, EmbeddedData], pd.Series[float]]:
+    """
+    `fast_parse` with results stored in `cache`, keyed by `parse_key`.
+
+    The cache is bypassed when writing stacked frames, as those are not stored.
+    """
+    key = parse_key(mp4_path, **kwargs)
+    stats: Optional[ParseStats] = kwargs.get("stats")
+    if not kwargs.get("write_stacked_frames"):
+        output = cache.get(key)
+        if output is not None:
+            logging.info(f"Using cached results for {mp4_path}")
+            if stats is not None:
+                stats.count("cache_hits")
+            return output  # type: ignore[no-any-return]
+    if stats is not None:
+        stats.count("cache_misses")
+    output = fast_parse(mp4_path, **kwargs)
+    try:
+        cache.put(key, output)
+    except OSError:
+        logging.warning(f"Failed to cache results of {mp4_path}", exc_info=True)
+    return output
+
+
+def _parse_video(
+    mp4_path: str,
+    output_directory: str,
+    gpx_path: Optional[str] = None,
+    cache: Optional[ResultCache] = None,
+    **kwargs: Any,
+) -> Optional[Tuple[dict[int, EmbeddedData], pd.Series[float], ParseStats]]:
+    """
+    Parse a video, streaming its updates to `gpx_path` as they are read if
+    given.
+    """
+    kwargs.setdefault("glyph_memo", _BATCH_GLYPH_MEMO)
+    stats = ParseStats()
+    writer: Optional[GPXWriter] = None
+    try:
+        if gpx_path is not None:
+            writer = GPXWriter(gpx_path)
+            writer.new_segment()
+            kwargs["on_update"] = lambda _, data, __: writer.add(data)
+        if cache is not None:
+            result, summary_stats = cached_parse(
+                mp4_path,
+                cache,
+                output_directory=output_directory,
+                stats=stats,
+                **kwargs,
+            )
+        else:
+            result, summary_stats = fast_parse(
+                mp4_path, output_directory=output_directory, stats=stats, **kwargs
+            )
+        if writer is not None:
+            with stats.stage("write_outputs"):
+                # Cached results were not streamed
+                if writer.points == 0:
+                    for frame_index in sorted(result):
+                        writer.add(result[frame_index])
+                writer.close()
+        return result, summary_stats, stats
+    except Exception:
+        logging.exception(f"Failed to parse {mp4_path}")
+        if writer is not None:
+            writer.abort()
+        return None
+
+
 def main() -> None:
     import argparse
+    from concurrent.futures import ProcessPoolExecutor
+
+    from .ride import RideGPXWriter, parse_ride
 
     parser = argparse.ArgumentParser(
         description="Extract GPX data embedded in MP4 video files from Garmin Varia RCT715 devices",
     )
-    parser.add_argument("mp4_path", type=str)
+    parser.add_argument(
+        "mp4_paths",
+        type=str,
+        nargs="+",
+        metavar="mp4_path",
+        help="MP4 files, directories of MP4 files or glob patterns",
+    )
     parser.add_argument("--csv", action="store_true", help="Output results to CSV file")
     parser.add_argument(
         "--write-stacked-frames",
@@ -167,64 +1349,319 @@ def main() -> None:
         default="",
         help="Directory to save output files",
     )
+    parser.add_argument(
+        "--decode",
+        choices=DECODE_MODES,
+        default="threshold",
+        help="ffmpeg output format; gray and monob decode only the luma plane and "
+        "are faster",
+    )
+    parser.add_argument(
+        "--skip-nonref",
+        action="store_true",
+        help="Skip decoding non-reference frames, duplicating the previous frame "
+        "in their place",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="Split each video into this many time ranges decoded in parallel "
+        "(requires --decode gray or monob)",
+    )
+    parser.add_argument(
+        "--band-directory",
+        type=str,
+        default=None,
+        metavar="DIRECTORY",
+        help="Save the decoded data band of each video to DIRECTORY, and read it "
+        "from there rather than decoding the video again on later runs",
+    )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Score only a few frames per second to find data updates, and stack "
+        "a subset of the frames of each update",
+    )
+    parser.add_argument(
+        "--no-pixel-diff",
+        action="store_true",
+        help="Score the seconds digit of every frame to find data updates, rather "
+        "than only frames whose pixels changed",
+    )
+    parser.add_argument(
+        "--temporal-prior",
+        action="store_true",
+        help="Score changed characters against the letters likely to follow the "
+        "previous update's first, falling back to every letter on low scores or "
+        "implausible reads",
+    )
+    parser.add_argument(
+        "--ocr-threads",
+        type=int,
+        default=1,
+        help="Number of threads OCR'ing the updates of each video",
+    )
+    parser.add_argument(
+        "--offset-search",
+        type=int,
+        default=DEFAULT_OFFSET_SEARCH,
+        help="Pixels either side of the expected position of each character that "
+        "are searched for it",
+    )
+    parser.add_argument(
+        "--ride",
+        action="store_true",
+        help="Treat the videos as consecutive clips of a ride: parse them in order, "
+        "carrying state across clips and decoding the next clip ahead of time, and "
+        "write the combined output as a single timeline",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of videos to process in parallel (0 to use all CPUs)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write cached results",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Parse videos again, replacing any cached results",
+    )
+    parser.add_argument(
+        "--cache-directory",
+        type=str,
+        default=None,
+        help="Directory of cached results (default: ~/.cache/rcttools)",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default=None,
+        metavar="DIRECTORY",
+        help="Append the updates to a dataset partitioned by date and ride "
+        "(requires pyarrow)",
+    )
+    parser.add_argument(
+        "--dataset-format",
+        choices=("parquet", "arrow"),
+        default="parquet",
+        help="File format of the dataset",
+    )
+    parser.add_argument(
+        "--combined-name",
+        type=str,
+        default="combined",
+        help="Base name of the combined output files when processing multiple videos",
+    )
     parser.add_argument(
         "--show-stats", action="store_true", help="Show summary statistics"
     )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Append per-stage timings and counters of each video to a JSON lines "
+        "file",
+    )
     parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
 
     args = parser.parse_args()
+    if args.segments > 1 and (args.decode == "threshold" or args.skip_nonref):
+        parser.error(
+            "--segments requires --decode gray or monob, without --skip-nonref"
+        )
+    if args.dataset:
+        try:
+            from .dataset import append_ride
+        except ImportError:
+            parser.error("--dataset requires pyarrow: pip install rcttools[parquet]")
 
-    mp4_path = args.mp4_path
-    prefix = os.path.dirname(mp4_path)
-    if args.output_directory:
-        prefix = args.output_directory
-    basename = os.path.basename(mp4_path).rsplit(".", 1)[0]
     csv = args.csv
     gpx = not args.no_gpx
     show_stats = args.show_stats
-    if args.verbose:
-        logging.basicConfig(level=logging.INFO)
-    else:
-        logging.basicConfig(level=logging.WARNING)
-    result, summary_stats = fast_parse(
-        mp4_path,
+    level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=level)
+
+    mp4_paths = find_videos(args.mp4_paths)
+    prefixes = [args.output_directory or os.path.dirname(p) for p in mp4_paths]
+    gpx_paths = [
+        os.path.join(prefix, f"{os.path.basename(mp4_path).rsplit('.', 1)[0]}.gpx")
+        for mp4_path, prefix in zip(mp4_paths, prefixes)
+    ]
+    cache = (
+        None
+        if args.no_cache
+        else ResultCache(args.cache_directory, refresh=args.refresh)
+    )
+    parse_kwargs: Dict[str, Any] = dict(
         write_stacked_frames=args.write_stacked_frames,
-        output_directory=prefix,
-    )
-
-    if show_stats or args.verbose:
-        output_func = print if not args.verbose else logging.info
-        output_func(f"Summary statistics for {mp4_path}:")
-        stats = summary_stats.to_frame(name="goodness_of_fit")
-        stats.index.name = "frame_index"
-        output_func(stats)
-
-    if csv:
-        df = pd.DataFrame.from_dict(result, orient="index")
-        df.index.name = "frame_index"
-        csv_path = os.path.join(prefix, f"{basename}.csv")
-        df.to_csv(csv_path)
-
-    if gpx:
-        gpx_obj = GPX()
-        track = GPXTrack()
-        gpx_obj.tracks.append(track)
-        segment = GPXTrackSegment()
-        track.segments.append(segment)
-
-        for frame_index in sorted(result.keys()):
-            data = result[frame_index]
-            if data["latitude"] is not None and data["longitude"] is not None:
-                segment.points.append(
-                    GPXTrackPoint(
-                        latitude=float(data["latitude"]),
-                        longitude=float(data["longitude"]),
-                        time=data["datetime"],
-                    )
-                )
-        gpx_path = os.path.join(prefix, f"{basename}.gpx")
-        with open(gpx_path, "w") as f:
-            f.write(gpx_obj.to_xml(version="1.1"))
+        decode=args.decode,
+        skip_nonref=args.skip_nonref,
+        segments=args.segments,
+        band_directory=args.band_directory,
+        sample_step=SPARSE_SAMPLE_STEP if args.sparse else 1,
+        stack_step=SPARSE_STACK_STEP if args.sparse else 1,
+        pixel_diff=not args.no_pixel_diff,
+        ocr_threads=args.ocr_threads,
+        offset_search=args.offset_search,
+        temporal_prior=args.temporal_prior,
+        layouts=LayoutCache(cache),
+    )
+    parse_video = partial(_parse_video, cache=cache, **parse_kwargs)
+    # Each video's GPX file, and the combined GPX file, are written as their
+    # updates are read
+    streamed_gpx_paths: List[Optional[str]] = (
+        list(gpx_paths) if gpx else [None] * len(mp4_paths)
+    )
+    combined_prefix = ""
+    combined_gpx: Optional[GPXWriter] = None
+    if len(mp4_paths) > 1:
+        combined_prefix = args.output_directory or os.path.commonpath(
+            [os.path.abspath(p) for p in prefixes]
+        )
+        if gpx:
+            combined_gpx = GPXWriter(
+                os.path.join(combined_prefix, f"{args.combined_name}.gpx")
+            )
+    ride_gpx: Optional[RideGPXWriter] = None
+    executor: Optional[ProcessPoolExecutor] = None
+    parsed: Iterator[
+        Tuple[
+            str, Optional[Tuple[dict[int, EmbeddedData], pd.Series[float], ParseStats]]
+        ]
+    ]
+    jobs = args.jobs or os.cpu_count() or 1
+    if args.ride:
+        ride_gpx = writer = RideGPXWriter(
+            dict(zip(mp4_paths, gpx_paths)) if gpx else {}, combined_gpx
+        )
+        parsed = parse_ride(
+            mp4_paths,
+            prefixes,
+            cache,
+            on_update=lambda mp4_path, _, data, __: writer.add(mp4_path, data),
+            **parse_kwargs,
+        )
+    elif jobs > 1 and len(mp4_paths) > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(level,)
+        )
+        parsed = zip(
+            mp4_paths,
+            executor.map(parse_video, mp4_paths, prefixes, streamed_gpx_paths),
+        )
+    else:
+        parsed = zip(
+            mp4_paths, map(parse_video, mp4_paths, prefixes, streamed_gpx_paths)
+        )
+
+    # Results are only kept for the outputs written once every video is parsed
+    keep_results = bool(args.dataset) or (csv and len(mp4_paths) > 1)
+    results: Dict[str, Dict[int, EmbeddedData]] = {}
+    goodness_of_fit: Dict[str, pd.Series[float]] = {}
+    failed = 0
+    try:
+        prefix_of = dict(zip(mp4_paths, prefixes))
+        for mp4_path, output in parsed:
+            if ride_gpx is not None:
+                ride_gpx.finish(mp4_path, output[0] if output is not None else None)
+            if output is None:
+                failed += 1
+                continue
+            result, summary_stats, parse_stats = output
+            if keep_results:
+                results[mp4_path] = result
+                goodness_of_fit[mp4_path] = summary_stats
+            basename = os.path.basename(mp4_path).rsplit(".", 1)[0]
+
+            if show_stats or args.verbose:
+                output_func = print if not args.verbose else logging.info
+                output_func(f"Summary statistics for {mp4_path}:")
+                stats = summary_stats.to_frame(name="goodness_of_fit")
+                stats.index.name = "frame_index"
+                output_func(stats)
+
+            with parse_stats.stage("write_outputs"):
+                if csv:
+                    csv_path = os.path.join(prefix_of[mp4_path], f"{basename}.csv")
+                    write_csv(result, csv_path)
+                # One segment per video, unless they form a ride
+                if combined_gpx is not None and ride_gpx is None:
+                    combined_gpx.new_segment()
+                    for frame_index in sorted(result):
+                        combined_gpx.add(result[frame_index])
+
+            if args.profile:
+                with open(args.profile, "a") as f:
+                    f.write(json.dumps({"mp4_path": mp4_path, **parse_stats.to_dict()}))
+                    f.write("\n")
+    except BaseException:
+        if ride_gpx is not None:
+            ride_gpx.abort()
+        elif combined_gpx is not None:
+            combined_gpx.abort()
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if ride_gpx is not None:
+        ride_gpx.close()
+    elif combined_gpx is not None:
+        if failed < len(mp4_paths):
+            combined_gpx.close()
+        else:
+            combined_gpx.abort()
+
+    if args.dataset:
+        from .ride import stitch
+
+        # Otherwise each video is a ride of its own
+        rides = (
+            [stitch(results)]
+            if args.ride
+            else [
+                [
+                    (mp4_path, frame_index, result[frame_index])
+                    for frame_index in sorted(result)
+                ]
+                for mp4_path, result in results.items()
+            ]
+        )
+        for rows in rides:
+            append_ride(args.dataset, rows, goodness_of_fit, args.dataset_format)
+
+    if len(mp4_paths) > 1 and csv and results:
+        import pandas as pd
+
+        if args.ride:
+            from .ride import stitch
+
+            rows = stitch(results)
+            results = {
+                mp4_path: {
+                    frame_index: data
+                    for path, frame_index, data in rows
+                    if path == mp4_path
+                }
+                for mp4_path in dict.fromkeys(path for path, _, _ in rows)
+            }
+        df = pd.concat(
+            {
+                mp4_path: pd.DataFrame.from_dict(result, orient="index")
+                for mp4_path, result in results.items()
+            },
+            names=["mp4_path", "frame_index"],
+        )
+        df.to_csv(os.path.join(combined_prefix, f"{args.combined_name}.csv"))
+
+    if failed:
+        raise SystemExit(f"Failed to parse {failed} of {len(mp4_paths)} videos")
 
 
 if __name__ == "__main__":
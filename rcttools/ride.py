@@ -0,0 +1,454 @@
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import queue
+import threading
+from functools import partial
+from itertools import chain
+from types import TracebackType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+import numpy as np
+
+from .alphabet import GlyphMemo
+from .cache import LayoutCache, ResultCache
+from .common import BOOL_VIDEO_TYPE, INK_FRAME_TYPE
+from .gpx import GPXWriter
+from .rct2gpx import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_OFFSET_SEARCH,
+    PROBE_FRAMES,
+    StackedFrameReader,
+    fast_parse,
+    parse_key,
+    read_band,
+    select_y_offset,
+    stream_video,
+)
+from .stats import ParseStats
+from .text_format import EmbeddedData, StateMachine
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Chunks decoded ahead of time for the next video, on top of the pipe's buffer
+PREFETCH_CHUNKS = 2
+
+# (video, frame index, data) of each update of a ride
+RideRow = Tuple[str, int, EmbeddedData]
+# Output of `rct2gpx._parse_video`
+ParseOutput = Tuple[Dict[int, EmbeddedData], "pd.Series[float]", ParseStats]
+
+
+class Prefetcher:
+    """
+    Consume an iterator of chunks on a background thread, holding at most
+    `max_chunks` chunks until they are read.
+
+    Closing the prefetcher closes the iterator, stopping its ffmpeg process.
+    """
+
+    _DONE = object()
+
+    def __init__(
+        self, chunks: Iterator[BOOL_VIDEO_TYPE], max_chunks: int = PREFETCH_CHUNKS
+    ) -> None:
+        self.queue: queue.Queue[Any] = queue.Queue(max_chunks)
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(chunks,), daemon=True)
+        self.thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self, chunks: Iterator[BOOL_VIDEO_TYPE]) -> None:
+        try:
+            for chunk in chunks:
+                if not self._put(chunk):
+                    return
+            self._put(self._DONE)
+        except BaseException as e:
+            self._put(e)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def __iter__(self) -> Iterator[BOOL_VIDEO_TYPE]:
+        return self
+
+    def __next__(self) -> BOOL_VIDEO_TYPE:
+        item = self.queue.get()
+        if item is self._DONE:
+            self.queue.put(item)
+            raise StopIteration
+        if isinstance(item, BaseException):
+            raise item
+        return item  # type: ignore[no-any-return]
+
+    def close(self) -> None:
+        self.closed.set()
+        self.thread.join()
+
+
+def probe_start(
+    mp4_path: str,
+    glyph_memo: Optional[GlyphMemo] = None,
+    layouts: Optional[LayoutCache] = None,
+    **kwargs: Any,
+) -> Optional[dt.datetime]:
+    """
+    Read the time of a video's first update from its first frame, decoding only
+    the first `PROBE_FRAMES` frames, or return None if it cannot be read.
+    """
+    decode = kwargs.get("decode", "threshold")
+    skip_nonref = kwargs.get("skip_nonref", False)
+    chunks = read_band(
+        mp4_path, PROBE_FRAMES, kwargs.get("band_directory"), decode, skip_nonref
+    )
+    if chunks is None:
+        chunks = stream_video(mp4_path, PROBE_FRAMES, decode, skip_nonref)
+    try:
+        first = next(chunks, None)
+        if first is None:
+            return None
+        expected = layouts.get(os.path.dirname(mp4_path)) if layouts else None
+        y_offset = select_y_offset(first[:: kwargs.get("sample_step", 1)], expected)
+        reader = StackedFrameReader(
+            StateMachine(use_parity=y_offset != 0), y_offset, glyph_memo
+        )
+        frame: INK_FRAME_TYPE = first[0].astype(np.uint8) * np.uint8(255)
+        data, _ = reader.read(frame)
+    except Exception:
+        logging.warning(f"Failed to read the start of {mp4_path}", exc_info=True)
+        return None
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    return data["datetime"]
+
+
+def ride_order(
+    mp4_paths: Sequence[str],
+    cached: Dict[str, ParseOutput],
+    glyph_memo: Optional[GlyphMemo] = None,
+    **kwargs: Any,
+) -> List[str]:
+    """
+    Order the videos of a ride by the time of their first update, read from the
+    `cached` results of a video or else with `probe_start`.
+
+    Videos whose first update cannot be read keep their order, after the others.
+    """
+    starts: List[Tuple[dt.datetime, int, str]] = []
+    unknown: List[str] = []
+    for i, mp4_path in enumerate(mp4_paths):
+        start: Optional[dt.datetime] = None
+        if mp4_path in cached:
+            result = cached[mp4_path][0]
+            start = result[min(result)]["datetime"] if result else None
+        elif len(mp4_paths) > 1:
+            start = probe_start(mp4_path, glyph_memo, **kwargs)
+        if start is None:
+            unknown.append(mp4_path)
+        else:
+            starts.append((start, i, mp4_path))
+    ordered = [mp4_path for _, _, mp4_path in sorted(starts)]
+    if unknown and ordered:
+        logging.warning(
+            f"Could not read the start time of {', '.join(unknown)}, "
+            "parsing them last"
+        )
+    if ordered != [mp4_path for _, _, mp4_path in starts]:
+        logging.info(f"Parsing the ride in the order {', '.join(ordered + unknown)}")
+    return ordered + unknown
+
+
+def parse_ride(
+    mp4_paths: Sequence[str],
+    output_directories: Sequence[str],
+    cache: Optional[ResultCache] = None,
+    on_update: Optional[Callable[[str, int, EmbeddedData, float], None]] = None,
+    **kwargs: Any,
+) -> Iterator[Tuple[str, Optional[ParseOutput]]]:
+    """
+    Parse consecutive videos of a ride in chronological order (see
+    `ride_order`), yielding the path of each video along with its output like
+    `rct2gpx._parse_video`, or None if it failed.
+
+    `on_update` is called with the path of the video along with the arguments
+    of `fast_parse`'s, as each update is read. Cached results are only yielded.
+
+    The previous update read, for incremental OCR, is carried over from one
+    video to the next while the y offset stays the same. Decoding of the next
+    video starts while the current one is parsed, and cached results are looked
+    up before any decoding starts.
+    """
+    chunk_size = kwargs.pop("chunk_size", DEFAULT_CHUNK_SIZE)
+    glyph_memo = kwargs.pop("glyph_memo", None) or GlyphMemo()
+    incremental = kwargs.pop("incremental", True)
+    offset_search = kwargs.get("offset_search", DEFAULT_OFFSET_SEARCH)
+    temporal_prior = kwargs.get("temporal_prior", False)
+    layouts: Optional[LayoutCache] = kwargs.get("layouts")
+
+    keys: Dict[str, Optional[str]] = {}
+    cached: Dict[str, Any] = {}
+    for mp4_path in mp4_paths:
+        keys[mp4_path] = None
+        if cache is None:
+            continue
+        try:
+            key = keys[mp4_path] = parse_key(mp4_path, **kwargs)
+        except OSError:
+            continue
+        if not kwargs.get("write_stacked_frames"):
+            output = cache.get(key)
+            if output is not None:
+                cached[mp4_path] = output
+
+    directories = dict(zip(mp4_paths, output_directories))
+    mp4_paths = ride_order(mp4_paths, cached, glyph_memo, **kwargs)
+    pending = [p for p in mp4_paths if p not in cached]
+    stats = {mp4_path: ParseStats() for mp4_path in mp4_paths}
+    decoders: Dict[str, Prefetcher] = {}
+
+    def start(index: int) -> None:
+        if index < len(pending) and pending[index] not in decoders:
+            mp4_path = pending[index]
+            decode = kwargs.get("decode", "threshold")
+            skip_nonref = kwargs.get("skip_nonref", False)
+            chunks = read_band(
+                mp4_path, chunk_size, kwargs.get("band_directory"), decode, skip_nonref
+            )
+            if chunks is None:
+                chunks = stream_video(
+                    mp4_path,
+                    chunk_size,
+                    decode,
+                    skip_nonref,
+                    stats[mp4_path],
+                    kwargs.get("segments", 1),
+                )
+            decoders[mp4_path] = Prefetcher(chunks)
+
+    reader: Optional[StackedFrameReader] = None
+    try:
+        for mp4_path in mp4_paths:
+            if mp4_path in cached:
+                logging.info(f"Using cached results for {mp4_path}")
+                stats[mp4_path].count("cache_hits")
+                yield mp4_path, (*cached[mp4_path], stats[mp4_path])
+                continue
+
+            index = pending.index(mp4_path)
+            start(index)
+            start(index + 1)
+            decoder = decoders.pop(mp4_path)
+            try:
+                # The y offset of the previous video is checked against the
+                # first frames of every video rather than trusted
+                chunks: Iterator[BOOL_VIDEO_TYPE] = decoder
+                first = next(decoder, None)
+                if first is not None:
+                    chunks = chain([first], decoder)
+                    directory = os.path.dirname(mp4_path)
+                    if reader is not None:
+                        expected: Optional[int] = reader.y_offset
+                    elif layouts is not None:
+                        expected = layouts.get(directory)
+                    else:
+                        expected = None
+                    y_offset = select_y_offset(
+                        first[:: kwargs.get("sample_step", 1)], expected
+                    )
+                    if layouts is not None:
+                        layouts.put(directory, y_offset)
+                    if reader is None or reader.y_offset != y_offset:
+                        reader = StackedFrameReader(
+                            StateMachine(use_parity=y_offset != 0),
+                            y_offset,
+                            glyph_memo,
+                            incremental,
+                            offset_search,
+                            temporal_prior,
+                        )
+                if cache is not None:
+                    stats[mp4_path].count("cache_misses")
+                output = fast_parse(
+                    mp4_path,
+                    output_directory=directories[mp4_path],
+                    chunk_size=chunk_size,
+                    glyph_memo=glyph_memo,
+                    stats=stats[mp4_path],
+                    reader=reader,
+                    chunks=chunks,
+                    on_update=(
+                        partial(on_update, mp4_path) if on_update is not None else None
+                    ),
+                    **kwargs,
+                )
+            except Exception:
+                logging.exception(f"Failed to parse {mp4_path}")
+                yield mp4_path, None
+                continue
+            finally:
+                decoder.close()
+
+            output_key = keys[mp4_path]
+            if cache is not None and output_key is not None:
+                try:
+                    cache.put(output_key, output)
+                except OSError:
+                    logging.warning(
+                        f"Failed to cache results of {mp4_path}", exc_info=True
+                    )
+            yield mp4_path, (*output, stats[mp4_path])
+    finally:
+        for decoder in decoders.values():
+            decoder.close()
+
+
+def stitch(results: Dict[str, Dict[int, EmbeddedData]]) -> List[RideRow]:
+    """
+    Order the results of each video by the time of their first update and
+    concatenate them into a single timeline.
+
+    Leading updates of a video that are not later than the last update of the
+    previous video, as where consecutive videos overlap, are dropped.
+    """
+    ordered = sorted(
+        ((path, result) for path, result in results.items() if result),
+        key=lambda item: item[1][min(item[1])]["datetime"],
+    )
+    rows: List[RideRow] = []
+    for mp4_path, result in ordered:
+        last = rows[-1][2]["datetime"] if rows else None
+        for frame_index in sorted(result):
+            data = result[frame_index]
+            if last is not None and data["datetime"] <= last:
+                continue
+            last = None
+            rows.append((mp4_path, frame_index, data))
+    return rows
+
+
+class RideGPXWriter:
+    """
+    Write the updates of a ride's videos, as they are read, to a GPX file per
+    video in `gpx_paths` and to the `combined` GPX file, if given, as a single
+    segment.
+
+    As in `stitch`, leading updates of a video that are not later than the last
+    update of the ride are left out of the combined file. Videos are expected
+    in chronological order, as `parse_ride` parses them. A video starting
+    before the previous one is written whole, as a segment of its own, with a
+    warning.
+    """
+
+    def __init__(
+        self, gpx_paths: Dict[str, str], combined: Optional[GPXWriter] = None
+    ) -> None:
+        self.gpx_paths = gpx_paths
+        self.combined = combined
+        self.writers: Dict[str, GPXWriter] = {}
+        self.started: set[str] = set()
+        # First and last update in the combined file of the current video
+        self.first: Optional[dt.datetime] = None
+        self.last: Optional[dt.datetime] = None
+        self.overlapping = False
+
+    def add(self, mp4_path: str, data: EmbeddedData) -> None:
+        new_video = mp4_path not in self.started
+        self.started.add(mp4_path)
+        path = self.gpx_paths.get(mp4_path)
+        if path is not None:
+            if mp4_path not in self.writers:
+                self.writers[mp4_path] = GPXWriter(path)
+                self.writers[mp4_path].new_segment()
+            self.writers[mp4_path].add(data)
+        if self.combined is None:
+            return
+        time = data["datetime"]
+        if new_video:
+            self.overlapping = True
+            if self.first is not None and time < self.first:
+                logging.warning(
+                    f"{mp4_path} starts before the previous video, adding it to "
+                    "the combined GPX file as a segment of its own"
+                )
+                self.combined.new_segment()
+                self.overlapping = False
+                self.first = time
+        if self.overlapping:
+            if self.last is not None and time <= self.last:
+                return
+            self.overlapping = False
+            self.first = time
+        self.combined.add(data)
+        self.last = time
+
+    def finish(self, mp4_path: str, result: Optional[Dict[int, EmbeddedData]]) -> None:
+        """
+        Complete the GPX file of a video once parsed, adding the updates of
+        `result` if none were streamed, as for cached results. The file of a
+        video that failed (`result` is None) is removed.
+        """
+        if result is not None and mp4_path not in self.started:
+            for frame_index in sorted(result):
+                self.add(mp4_path, result[frame_index])
+        writer = self.writers.pop(mp4_path, None)
+        if result is None:
+            if writer is not None:
+                writer.abort()
+            return
+        path = self.gpx_paths.get(mp4_path)
+        if writer is None and path is not None:
+            writer = GPXWriter(path)
+        if writer is not None:
+            writer.close()
+
+    def close(self) -> None:
+        for writer in self.writers.values():
+            writer.close()
+        if self.combined is not None:
+            self.combined.close()
+
+    def abort(self) -> None:
+        for writer in self.writers.values():
+            writer.abort()
+        if self.combined is not None:
+            self.combined.abort()
+
+    def __enter__(self) -> RideGPXWriter:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,50 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Sequence
+
+# Called with the stage name and its wall and CPU seconds as each stage ends
+StageHook = Callable[[str, float, float], None]
+
+
+class ParseStats:
+    """
+    Wall and CPU time spent in each stage of parsing a video, and counters of
+    the work done.
+
+    CPU time is that of the Python process; ffmpeg's is recorded separately as
+    the `ffmpeg` stage, with no wall time.
+    """
+
+    def __init__(self, hooks: Sequence[StageHook] = ()) -> None:
+        self.wall: Dict[str, float] = {}
+        self.cpu: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.hooks = list(hooks)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Hooks are local to the process that registered them
+        return {**self.__dict__, "hooks": []}
+
+    def add_time(self, stage: str, wall: float, cpu: float) -> None:
+        self.wall[stage] = self.wall.get(stage, 0.0) + wall
+        self.cpu[stage] = self.cpu.get(stage, 0.0) + cpu
+        for hook in self.hooks:
+            hook(stage, wall, cpu)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time the enclosed block as part of stage `name`.
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"wall": self.wall, "cpu": self.cpu, "counters": self.counters}
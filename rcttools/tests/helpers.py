@@ -0,0 +1,58 @@
+from typing import List
+
+import numpy as np
+
+from ..alphabet import NEGATIVE, NUMBERS
+from ..band import BandWriter
+from ..common import INK_FRAME_TYPE
+from ..rct2gpx import BAND_HEIGHT, BAND_WIDTH
+from ..text_format import StateMachine
+
+
+def render_band(chars: List[str], y_offset: int = 0) -> INK_FRAME_TYPE:
+    """
+    Draw each read character at the offset given by the state machine.
+    """
+    frame = np.zeros((BAND_HEIGHT, BAND_WIDTH), dtype=np.uint8)
+    state_machine = StateMachine(use_parity=y_offset != 0)
+    for char in chars:
+        while not state_machine.get_alphabet():
+            state_machine.is_complete()
+        offset = state_machine.get_next_offset()
+        if char.isdigit() or char == "-":
+            mask = (NUMBERS[char] if char.isdigit() else NEGATIVE).mask
+            cell = frame[5 + y_offset : 35 + y_offset, offset:]
+            cell[: mask.shape[0], : mask.shape[1]] |= mask * np.uint8(255)
+        state_machine.append(char)
+    return frame  # type: ignore[return-value]
+
+
+def coordinate_chars(value: str) -> List[str]:
+    """
+    Characters of a coordinate with 5 decimals, the sign right-aligned against
+    the integer digits.
+    """
+    integer, fraction = value.split(".")
+    cells = [" "] * (4 - len(integer)) + list(integer)
+    return ["" if cells[0] == " " else cells[0], *cells[1:], *fraction]
+
+
+def band_chars(
+    timestamp: str, latitude: str = "47.62221", longitude: str = "-122.17650"
+) -> List[str]:
+    """
+    Characters of an update at `timestamp` (YYYYmmddHHMMSS), by default with
+    fixed coordinates.
+    """
+    return [*timestamp, *coordinate_chars(latitude), *coordinate_chars(longitude)]
+
+
+def write_band(path: str, timestamps: List[str], frames: int = 31) -> None:
+    """
+    Write a band file of v1 format updates at `timestamps`, each lasting
+    `frames` frames, which can be parsed in place of a video.
+    """
+    with BandWriter(path, BAND_HEIGHT, BAND_WIDTH) as writer:
+        for timestamp in timestamps:
+            frame = render_band(band_chars(timestamp), -1) != 0
+            writer.add(np.stack([frame] * frames))
@@ -0,0 +1,104 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from .. import alphabet
+from ..alphabet import (
+    GLYPHS,
+    NUMBERS,
+    NUMBERS_ALPHABET,
+    Alphabet,
+    FixedScore,
+    GlyphMemo,
+    compile_glyphs,
+    load_glyphs,
+)
+
+
+def test_alphabet_matches_characters() -> None:
+    frames = np.stack([NUMBERS[str(x)].mask for x in range(10)])
+    scores = NUMBERS_ALPHABET.score_packed(np.packbits(frames, axis=-1))
+    assert scores.shape == (10, 10)
+    best_fit = scores.argmax(axis=1)
+    assert [NUMBERS_ALPHABET.letters[i] for i in best_fit] == list("0123456789")
+
+
+def test_alphabet_fixed_score() -> None:
+    alphabet = Alphabet({"1": NUMBERS["1"], " ": FixedScore(0.8)})
+    video = np.stack([NUMBERS["1"].mask, np.zeros(NUMBERS["1"].mask.shape, bool)])
+    scores = alphabet.score_packed(np.packbits(video, axis=-1))
+    np.testing.assert_allclose(scores, [[1.0, 0.8], [0.0, 0.8]])
+
+
+def test_alphabet_score_packed() -> None:
+    rng = np.random.default_rng(1)
+    frames = np.stack([NUMBERS[str(x)].mask for x in range(10)])
+    frames = frames ^ (rng.random(frames.shape) < 0.05)
+    scores = NUMBERS_ALPHABET.score_packed(np.packbits(frames, axis=-1))
+    for i, letter in enumerate(NUMBERS_ALPHABET.letters):
+        np.testing.assert_allclose(
+            scores[:, i],
+            [NUMBERS[letter].score_frame(frame * np.uint8(255)) for frame in frames],
+        )
+
+
+def test_character_score_frame() -> None:
+    eight = NUMBERS["8"]
+    assert eight.score_frame(eight.mask * np.uint8(255)) == 1.0
+    # Half of the stacked frames have ink
+    assert eight.score_frame(eight.mask * np.uint8(255) // 2) == 127 / 255
+    assert NUMBERS["1"].score_frame(eight.mask * np.uint8(255)) == (
+        NUMBERS["1"].mask.sum() / eight.mask.sum()
+    )
+
+
+def test_glyph_memo() -> None:
+    memo = GlyphMemo(max_entries=2)
+    cells = [NUMBERS[str(x)].mask * np.uint8(255) for x in range(3)]
+    keys = [GlyphMemo.key(("0", "1"), cell) for cell in cells]
+    assert GlyphMemo.key(("0", "1"), cells[0].copy()) == keys[0]
+    assert GlyphMemo.key(("0",), cells[0]) != keys[0]
+
+    scores = [np.full((1, 2), score) for score in (1.0, 0.9, 0.5)]
+    assert memo.get(keys[0]) is None
+    memo.put(keys[0], scores[0])
+    memo.put(keys[1], scores[1])
+    assert memo.get(keys[0]) is scores[0]
+    memo.put(keys[2], scores[2])
+    assert memo.get(keys[1]) is None
+    assert memo.get(keys[0]) is scores[0]
+    assert (memo.hits, memo.misses) == (2, 2)
+
+
+def test_compile_glyphs(tmp_path: Path) -> None:
+    path = str(tmp_path / "glyphs.npz")
+    masks = compile_glyphs(path)
+    assert sorted(masks) == sorted(GLYPHS)
+    with np.load(path) as data:
+        for char in GLYPHS:
+            assert data[char].dtype == np.bool_
+            np.testing.assert_array_equal(data[char], masks[char])
+            np.testing.assert_array_equal(load_glyphs()[char], masks[char])
+
+
+def test_load_glyphs_outside_package(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    missing = tmp_path / "package" / "glyphs.npz"
+    monkeypatch.setattr(alphabet, "GLYPHS_PATH", str(missing))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    load_glyphs.cache_clear()
+    try:
+        masks = load_glyphs()
+        assert not missing.exists()
+        (cached,) = (tmp_path / "cache" / "rcttools").glob("glyphs-*.npz")
+
+        # Loaded from the cache directory without decoding the PNGs again
+        monkeypatch.setitem(sys.modules, "PIL", None)
+        load_glyphs.cache_clear()
+        for char in GLYPHS:
+            np.testing.assert_array_equal(load_glyphs()[char], masks[char])
+    finally:
+        load_glyphs.cache_clear()
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from ..band import BandWriter, open_band, read_header, save_band, stream_band
+from ..common import BOOL_VIDEO_TYPE
+from ..rct2gpx import fast_parse
+from .helpers import write_band
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_band_writer(tmp_path: Path, packed: bool) -> None:
+    ink = np.random.default_rng(0).random((5, 3, 13)) < 0.5
+    path = str(tmp_path / "video.rctband")
+    with BandWriter(path, 3, 13, packed, y=1035) as writer:
+        writer.add(ink[:2])
+        writer.add(ink[2:])
+
+    frames, header = open_band(path)
+    assert isinstance(frames, np.memmap)
+    assert frames.shape == (5, 3, 2 if packed else 13)
+    assert header["y"] == 1035
+    assert header["offset"] % 64 == 0
+    chunks = list(stream_band(path, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert (np.concatenate(chunks) == ink).all()
+
+
+def test_save_band(tmp_path: Path) -> None:
+    ink: BOOL_VIDEO_TYPE = np.zeros((4, 3, 13), dtype=np.bool_)  # type: ignore[assignment]
+    path = str(tmp_path / "video.rctband")
+    chunks = save_band(iter([ink, ink]), BandWriter(path, 3, 13))
+    next(chunks)
+    chunks.close()  # type: ignore[attr-defined]
+    # Only complete bands are kept
+    assert read_header(path) is None
+    assert not list(tmp_path.iterdir())
+
+    assert len(list(save_band(iter([ink, ink]), BandWriter(path, 3, 13)))) == 2
+    assert len(open_band(path)[0]) == 8
+
+
+def test_parse_band(tmp_path: Path) -> None:
+    path = str(tmp_path / "video.rctband")
+    write_band(path, [f"202506011345{second}" for second in (49, 50, 51)])
+
+    result, _ = fast_parse(path, chunk_size=40)
+    assert [str(data["datetime"]) for data in result.values()] == [
+        "2025-06-01 13:45:49",
+        "2025-06-01 13:45:50",
+        "2025-06-01 13:45:51",
+    ]
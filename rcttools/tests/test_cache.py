@@ -0,0 +1,49 @@
+import os
+from pathlib import Path
+
+from ..cache import FINGERPRINT_BYTES, LayoutCache, ResultCache, fingerprint
+
+
+def test_fingerprint(tmp_path: Path) -> None:
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(range(256)) * FINGERPRINT_BYTES)
+    key = fingerprint(str(path), decode="gray")
+    assert fingerprint(str(path), decode="gray") == key
+    assert fingerprint(str(path), decode="monob") != key
+
+    stat = os.stat(path)
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"\x00")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert fingerprint(str(path), decode="gray") != key
+
+
+def test_result_cache(tmp_path: Path) -> None:
+    cache = ResultCache(str(tmp_path))
+    assert cache.get("a") is None
+    cache.put("a", {0: 1.5})
+    assert cache.get("a") == {0: 1.5}
+    assert ResultCache(str(tmp_path), refresh=True).get("a") is None
+
+
+def test_result_cache_eviction(tmp_path: Path) -> None:
+    cache = ResultCache(str(tmp_path), max_bytes=2500)
+    for i, key in enumerate("abc"):
+        cache.put(key, bytes(1000))
+        os.utime(tmp_path / f"{key}.pickle", ns=(i, i))
+    assert cache.get("a") is None
+    cache.get("b")
+    os.utime(tmp_path / "c.pickle", ns=(0, 0))
+    cache.put("d", bytes(1000))
+    assert sorted(os.listdir(tmp_path)) == ["b.pickle", "d.pickle"]
+
+
+def test_layout_cache(tmp_path: Path) -> None:
+    results = ResultCache(str(tmp_path / "cache"))
+    layouts = LayoutCache(results)
+    assert layouts.get(str(tmp_path / "videos")) is None
+    layouts.put(str(tmp_path / "videos"), -1)
+    assert LayoutCache(results).get(str(tmp_path / "videos")) == -1
+    assert LayoutCache(results).get(str(tmp_path)) is None
+    assert LayoutCache().get(str(tmp_path / "videos")) is None
@@ -0,0 +1,70 @@
+import datetime as dt
+from decimal import Decimal
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+import pytest
+
+from ..ride import RideRow
+from ..text_format import EmbeddedData
+
+pytest.importorskip("pyarrow")
+
+from ..dataset import append_ride, open_dataset  # noqa: E402
+
+
+def _rows(mp4_path: str, start: dt.datetime, count: int) -> List[RideRow]:
+    return [
+        (
+            mp4_path,
+            i * 30,
+            EmbeddedData(
+                datetime=start + dt.timedelta(seconds=i),
+                latitude=Decimal("47.62221") if i else None,
+                longitude=Decimal("-122.17650") if i else None,
+            ),
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_append_ride(tmp_path: Path, file_format: str) -> None:
+    first = _rows("a.mp4", dt.datetime(2025, 6, 1, 23, 59, 58), 4)
+    second = _rows("b.mp4", dt.datetime(2025, 6, 2, 8, 0), 2)
+    fits = {"a.mp4": pd.Series({0: 0.5, 30: 0.9})}
+    for rows in (first, second, first):
+        append_ride(str(tmp_path), rows, fits, file_format)
+
+    dataset = open_dataset(str(tmp_path), file_format)
+    # Parsing a.mp4 again replaced its rows, which all belong to the day it
+    # started on
+    table = dataset.to_table().sort_by("datetime")
+    assert table["mp4_path"].to_pylist() == ["a.mp4"] * 4 + ["b.mp4"] * 2
+    assert table["latitude"].to_pylist()[:2] == [None, 47.62221]
+    assert table["goodness_of_fit"].to_pylist()[:3] == [0.5, 0.9, None]
+
+    import pyarrow.dataset as ds  # type: ignore[import-untyped]
+
+    june_2 = dataset.to_table(columns=["ride"], filter=ds.field("date") == "2025-06-02")
+    assert june_2["ride"].to_pylist() == ["20250602T080000"] * 2
+
+
+def test_append_ride_subset(tmp_path: Path) -> None:
+    ride = [
+        *_rows("a.mp4", dt.datetime(2025, 6, 1, 8, 0), 3),
+        *_rows("b.mp4", dt.datetime(2025, 6, 1, 8, 0, 3), 3),
+        *_rows("c.mp4", dt.datetime(2025, 6, 1, 8, 0, 6), 3),
+    ]
+    assert len(append_ride(str(tmp_path), ride, {})) == 3
+    # Parsed again without its first video, the ride starts later
+    append_ride(str(tmp_path), ride[3:], {})
+
+    table = open_dataset(str(tmp_path)).to_table().sort_by("datetime")
+    assert (
+        table["mp4_path"].to_pylist() == ["a.mp4"] * 3 + ["b.mp4"] * 3 + ["c.mp4"] * 3
+    )
+    assert (
+        table["ride"].to_pylist() == ["20250601T080000"] * 3 + ["20250601T080003"] * 6
+    )
@@ -0,0 +1,61 @@
+from typing import List
+
+import numpy as np
+
+from ..alphabet import NUMBERS
+from ..detection import (
+    MIN_UPDATE_FRAMES,
+    Change,
+    ChangeDetector,
+    DiffChangeDetector,
+    SparseChangeDetector,
+    seconds_digit_cells,
+)
+
+
+def _video(lengths: List[int], y_offset: int = 0) -> np.ndarray:
+    frames = []
+    for i, length in enumerate(lengths):
+        frame = np.zeros((40, 1450), dtype=bool)
+        seconds_digit_cells(frame[None], y_offset)[0] |= NUMBERS[str(i % 10)].mask
+        frames.extend([frame] * length)
+    return np.stack(frames)
+
+
+def _detect(detector: ChangeDetector, ink: np.ndarray, chunk_size: int) -> List[Change]:
+    changes: List[Change] = []
+    for start in range(0, len(ink), chunk_size):
+        changes.extend(detector.detect(ink[start : start + chunk_size], start))
+    return changes
+
+
+def test_sparse_matches_dense() -> None:
+    lengths = [12, 31, 29, 32, 30, 29, 29, 32, 31, 30, 5]
+    assert min(lengths[1:-1]) >= MIN_UPDATE_FRAMES
+    for y_offset in (0, -1):
+        ink = _video(lengths, y_offset)
+        expected = _detect(ChangeDetector(y_offset), ink, len(ink))
+        assert [c for c, _ in expected] == list(np.cumsum([0] + lengths[:-1]))
+        for chunk_size in (7, 64, 256):
+            assert _detect(ChangeDetector(y_offset), ink, chunk_size) == expected
+            assert _detect(DiffChangeDetector(y_offset), ink, chunk_size) == expected
+            for step in (1, 8, 16):
+                detector = SparseChangeDetector(y_offset, step)
+                assert _detect(detector, ink, chunk_size) == expected
+
+
+def test_diff_detector() -> None:
+    lengths = [12, 31, 29, 32, 30]
+    ink = _video(lengths)
+    # A glitch showing the wrong digit for a frame, and noise on another
+    ink[20] = ink[80]
+    ink[50, 10:14, 561:565] ^= True
+    dense = _detect(ChangeDetector(0), ink, 64)
+    assert [c for c, _ in dense] == [0, 12, 20, 21, 43, 72, 104]
+
+    detector = DiffChangeDetector(0)
+    changes = _detect(detector, ink, 64)
+    assert [c for c, _ in changes] == [0, 12, 43, 72, 104]
+    assert detector.frames_rejected == 1
+    # The changes, the glitch, and the noisy frame and the one after it
+    assert detector.frames_scored == 5 + 1 + 2
@@ -1,5 +1,5 @@
 from ..alphabet import NEGATIVE_OR_NOTHING, NEGATIVE_OR_NUMBER, NUMBERS
-from ..text_format import Coordinate, DateTime, StateMachine
+from ..text_format import Coordinate, DateTime, StateMachine, embedded_data, layouts
 
 
 def test_datetime_format() -> None:
@@ -290,3 +290,26 @@ def test_state_machine() -> None:
     assert state_machine_parity.get_next_offset() == 235
     state_machine_parity.append("0")
     assert state_machine_parity.get_next_offset() == 257
+
+
+def test_layouts() -> None:
+    for use_parity in (False, True):
+        table = layouts(use_parity)
+        # Sign and padding of the integer part of each coordinate
+        assert len(table) == 8 * 8
+        assert {len(layout.offsets) for layout in table} == {32}
+        assert len({layout.offsets[:14] for layout in table}) == 1
+
+    state_machine = StateMachine()
+    chars = [*"20250601134549", "", " ", "4", "7", *"62221"]
+    chars += ["-", "1", "2", "2", *"17650"]
+    offsets = []
+    for char in chars:
+        while not state_machine.get_alphabet():
+            state_machine.is_complete()
+        offsets.append(state_machine.get_next_offset())
+        state_machine.append(char)
+    assert tuple(offsets) in {layout.offsets for layout in layouts()}
+    # Appends the trailing space
+    assert state_machine.get_alphabet() == {}
+    assert embedded_data(chars) == state_machine.result()
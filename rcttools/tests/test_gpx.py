@@ -0,0 +1,50 @@
+import datetime as dt
+from decimal import Decimal
+from pathlib import Path
+
+import gpxpy
+import pytest
+
+from ..gpx import GPXWriter
+from ..text_format import EmbeddedData
+
+
+def _data(second: int, latitude: str = "47.62220") -> EmbeddedData:
+    return EmbeddedData(
+        datetime=dt.datetime(2025, 6, 1, 13, 45, second),
+        latitude=Decimal(latitude),
+        longitude=Decimal("-122.17650"),
+    )
+
+
+def test_gpx_writer(tmp_path: Path) -> None:
+    path = tmp_path / "ride.gpx"
+    with GPXWriter(str(path)) as writer:
+        writer.add(_data(0))
+        writer.add(
+            EmbeddedData(datetime=_data(1)["datetime"], latitude=None, longitude=None)
+        )
+        # Points reach the disk before the file is complete
+        writer.file.flush()
+        assert "<trkpt" in (tmp_path / "ride.gpx.part").read_text()
+        writer.new_segment()
+        writer.new_segment()
+        writer.add(_data(2, "-0.00001"))
+    assert not (tmp_path / "ride.gpx.part").exists()
+
+    with open(path) as f:
+        track = gpxpy.parse(f).tracks[0]
+    assert [len(segment.points) for segment in track.segments] == [1, 0, 1]
+    first, last = track.segments[0].points[0], track.segments[2].points[0]
+    assert (first.latitude, first.longitude) == (47.6222, -122.1765)
+    assert first.time == dt.datetime(2025, 6, 1, 13, 45)
+    assert last.latitude == -0.00001
+    assert 'lat="47.6222" lon="-122.1765"' in path.read_text()
+
+
+def test_gpx_writer_abort(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        with GPXWriter(str(tmp_path / "ride.gpx")) as writer:
+            writer.add(_data(0))
+            raise ValueError
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,333 @@
+import csv
+import shutil
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+import gpxpy
+import numpy as np
+import pytest
+
+from ..alphabet import GlyphMemo
+from ..cache import ResultCache
+from ..common import BOOL_VIDEO_TYPE
+from ..rct2gpx import (
+    BAND_HEIGHT,
+    BAND_WIDTH,
+    BAND_Y,
+    DECODE_MODES,
+    OCR_BATCH_SIZE,
+    StackedFrameReader,
+    _ocr_executor,
+    _parse_video,
+    _Update,
+    _read_batch,
+    find_videos,
+    main,
+    probe_y_offset,
+    segment_starts,
+    select_y_offset,
+    stream_video,
+)
+from ..ride import parse_ride
+from ..text_format import StateMachine
+from .helpers import band_chars, render_band, write_band
+
+
+def test_stacked_frame_reader() -> None:
+    for y_offset in (0, -1):
+        reader = StackedFrameReader(StateMachine(y_offset != 0), y_offset)
+        first, score = reader.read(render_band(band_chars("20250601134549"), y_offset))
+        assert str(first["datetime"]) == "2025-06-01 13:45:49"
+        assert first["latitude"] == Decimal("47.62221")
+        assert first["longitude"] == Decimal("-122.17650")
+        assert score > 0.9
+        assert reader.reused == 0
+        scored = reader.scored
+
+        second, _ = reader.read(render_band(band_chars("20250601134550"), y_offset))
+        assert str(second["datetime"]) == "2025-06-01 13:45:50"
+        assert second["longitude"] == first["longitude"]
+        # Only the cells of the two seconds digits
+        assert reader.scored - scored == 2
+        assert reader.reused == scored - 2
+
+
+def test_glyph_memo_reads() -> None:
+    frames = [
+        render_band(band_chars(f"202506011345{second}")) for second in (49, 50, 49)
+    ]
+    for incremental in (True, False):
+        reader = StackedFrameReader(StateMachine(), 0, GlyphMemo(), incremental)
+        # The last frame is read entirely from the memo
+        reads = [str(reader.read(frame)[0]["datetime"]) for frame in frames]
+        assert reads == [
+            "2025-06-01 13:45:49",
+            "2025-06-01 13:45:50",
+            "2025-06-01 13:45:49",
+        ]
+
+
+def test_temporal_prior() -> None:
+    timestamps = ["20250601134549", "20250601134550", "20250601134551"]
+    # Implausible jump, read again without the prior
+    timestamps.append("20250601140000")
+    frames = [render_band(band_chars(timestamp), -1) for timestamp in timestamps]
+    reader = StackedFrameReader(StateMachine(True), -1, temporal_prior=True)
+    full = StackedFrameReader(StateMachine(True), -1)
+    reads = [reader.read(frame) for frame in frames[:3]]
+    assert reads == [full.read(frame) for frame in frames[:3]]
+    assert reader.pruned > 0
+    assert reader.rejected == 0
+
+    data, _ = reader.read(frames[3])
+    assert str(data["datetime"]) == "2025-06-01 14:00:00"
+    assert reader.rejected == 1
+
+
+def test_temporal_prior_layout_change() -> None:
+    # The latitude gains an integer digit and the longitude loses its sign
+    coordinates = [
+        ("9.99994", "-0.00003"),
+        ("9.99999", "-0.00001"),
+        ("10.00009", "0.00007"),
+        ("10.00010", "0.00008"),
+    ]
+    frames = [
+        render_band(band_chars(f"2025060113455{i}", *coordinate), -1)
+        for i, coordinate in enumerate(coordinates)
+    ]
+    for glyph_memo in (None, GlyphMemo(0)):
+        reader = StackedFrameReader(
+            StateMachine(True), -1, glyph_memo, temporal_prior=True
+        )
+        reads = [reader.read(frame)[0] for frame in frames]
+        assert [
+            (str(data["latitude"]), str(data["longitude"])) for data in reads
+        ] == coordinates
+
+
+def test_threaded_batches() -> None:
+    frames = [
+        render_band(band_chars(f"202506011345{second:02d}"), -1)
+        for second in range(2 * OCR_BATCH_SIZE + 3)
+    ]
+    reader = StackedFrameReader(StateMachine(True), -1)
+    serial = [reader.read(frame) for frame in frames]
+    futures = [
+        _ocr_executor(4).submit(
+            _read_batch, reader.clone(), frames[i : i + OCR_BATCH_SIZE]
+        )
+        for i in range(0, len(frames), OCR_BATCH_SIZE)
+    ]
+    threaded = [read for future in futures for read in future.result()[0]]
+    assert threaded == serial
+
+
+def test_select_y_offset() -> None:
+    for y_offset in (0, -1):
+        ink = np.stack([render_band(band_chars("20250601134549"), y_offset) != 0] * 4)
+        assert probe_y_offset(ink) == y_offset
+        assert probe_y_offset(ink, expected=-1 - y_offset) == y_offset
+        assert select_y_offset(ink, expected=y_offset) == y_offset
+
+    blank: BOOL_VIDEO_TYPE = np.zeros(  # type: ignore[assignment]
+        (4, BAND_HEIGHT, BAND_WIDTH), dtype=np.bool_
+    )
+    assert probe_y_offset(blank) is None
+    assert select_y_offset(blank) == 0
+
+
+def test_update_stacking() -> None:
+    ink: BOOL_VIDEO_TYPE = np.zeros((6, 2, 3), dtype=np.bool_)  # type: ignore[assignment]
+    ink[:3, 0, 0] = True
+    ink[::2, 1, 2] = True
+    update = _Update(10, 1.0)
+    update.add(ink[:4], 10)
+    update.add(ink[4:], 14)
+    assert update.stacked_frame().tolist() == [[128, 0, 0], [0, 0, 128]]
+
+    # The buffer is reused, and only every other frame is counted
+    total = update.total
+    update = _Update(20, 1.0, stride=2, total=total)
+    update.add(ink, 20)
+    assert update.total is total
+    assert update.stacked_frame().tolist() == [[170, 0, 0], [0, 0, 255]]
+
+
+def test_offset_search() -> None:
+    frame = render_band(band_chars("20250601134549"), -1)
+    # Drifted by two pixels, which one pixel of search corrects by re-centering
+    # the band a pixel at a time
+    drifted = np.roll(frame, 2, axis=1)
+    exact = StackedFrameReader(StateMachine(True), -1, offset_search=0)
+    searched = StackedFrameReader(StateMachine(True), -1, offset_search=1)
+    assert exact.read(frame) == searched.read(frame)
+
+    data, score = searched.read(drifted)
+    assert str(data["datetime"]) == "2025-06-01 13:45:49"
+    assert data["longitude"] == Decimal("-122.17650")
+    assert searched.drift == 2
+    assert score > 0.95
+    # Without the search, the first digits are misread into an invalid date
+    with pytest.raises(ValueError):
+        exact.read(drifted)
+
+
+def test_segment_starts() -> None:
+    assert segment_starts(300, 4) == [0, 75, 150, 225]
+    assert segment_starts(301, 3) == [0, 100, 200]
+    assert segment_starts(2, 4) == [0, 1]
+    # Seeking is not frame accurate with the RGB threshold filter
+    with pytest.raises(ValueError):
+        next(stream_video("video.mp4", decode="threshold", segments=2))
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="requires ffmpeg")
+def test_decode_modes(tmp_path: Path) -> None:
+    import ffmpeg  # type: ignore[import-untyped]
+
+    # Losslessly encoded luma, with text above the white level (235) over a
+    # background below it; the band is static, as the threshold graph does not
+    # keep the source's frame timing
+    rng = np.random.default_rng(0)
+    luma = rng.integers(16, 230, (1080, 1920), dtype=np.uint8)
+    band = luma[BAND_Y : BAND_Y + BAND_HEIGHT, :BAND_WIDTH]
+    text = rng.random(band.shape) < 0.2
+    band[text] = rng.integers(240, 256, int(text.sum()), dtype=np.uint8)
+    chroma = np.full(1080 * 1920 // 2, 128, dtype=np.uint8)
+    path = str(tmp_path / "video.mp4")
+    process = (
+        ffmpeg.input("pipe:", format="rawvideo", pix_fmt="yuv420p", s="1920x1080")
+        .output(path, vcodec="libx264", pix_fmt="yuv420p", qp=0, preset="ultrafast")
+        .overwrite_output()
+        .run_async(pipe_stdin=True, quiet=True)
+    )
+    for _ in range(3):
+        process.stdin.write(luma.tobytes() + chroma.tobytes())
+    process.stdin.close()
+    assert process.wait() == 0
+
+    # yuv420p crops are rounded to even rows
+    top = BAND_Y - BAND_Y % 2
+    expected = luma[top : top + BAND_HEIGHT, :BAND_WIDTH] > 235
+    for decode in DECODE_MODES:
+        ink = np.concatenate(list(stream_video(path, decode=decode)))
+        assert len(ink) >= 3
+        assert (ink == expected).all(), decode
+
+
+def test_find_videos(tmp_path: Path) -> None:
+    clips = tmp_path / "clips"
+    clips.mkdir()
+    for name in ("b.MP4", "a.mp4", "notes.txt"):
+        (clips / name).touch()
+    (tmp_path / "c.mp4").touch()
+    (tmp_path / "d.mp4").touch()
+    assert find_videos(
+        [str(tmp_path / "d.mp4"), str(clips), str(tmp_path / "*.mp4")]
+    ) == [
+        str(tmp_path / "d.mp4"),
+        # Directories and globs are sorted, explicit files kept in order
+        str(clips / "a.mp4"),
+        str(clips / "b.MP4"),
+        str(tmp_path / "c.mp4"),
+        str(tmp_path / "d.mp4"),
+    ]
+    assert find_videos([str(tmp_path / "missing*.mp4")]) == []
+
+
+def test_combined_outputs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    paths = [str(tmp_path / "a.rctband"), str(tmp_path / "b.rctband")]
+    write_band(paths[0], ["20250601134549", "20250601134550"])
+    write_band(paths[1], ["20250601134551", "20250601134552", "20250601134553"])
+    output = tmp_path / "output"
+    output.mkdir()
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["rct2gpx", *paths, "--csv", "--no-cache", "--output-directory", str(output)],
+    )
+    main()
+
+    with open(output / "combined.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert [(row["mp4_path"], row["datetime"]) for row in rows] == [
+        (paths[0], "2025-06-01 13:45:49"),
+        (paths[0], "2025-06-01 13:45:50"),
+        (paths[1], "2025-06-01 13:45:51"),
+        (paths[1], "2025-06-01 13:45:52"),
+        (paths[1], "2025-06-01 13:45:53"),
+    ]
+    assert {row["latitude"] for row in rows} == {"47.62221"}
+    assert [row["frame_index"] for row in rows[2:]] == ["0", "31", "62"]
+
+    with open(output / "combined.gpx") as f:
+        gpx = gpxpy.parse(f)
+    # One segment per video
+    segments = gpx.tracks[0].segments
+    assert [len(segment.points) for segment in segments] == [2, 3]
+    assert str(segments[1].points[0].time) == "2025-06-01 13:45:51"
+    assert segments[0].points[0].longitude == -122.1765
+    # Each video also has outputs of its own
+    assert (output / "a.csv").exists() and (output / "b.gpx").exists()
+
+
+def test_dataset_requires_pyarrow(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = str(tmp_path / "a.rctband")
+    write_band(path, ["20250601134549"])
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    monkeypatch.delitem(sys.modules, "rcttools.dataset", raising=False)
+    monkeypatch.setattr(sys, "argv", ["rct2gpx", path, "--dataset", str(tmp_path)])
+    # Fails before parsing anything
+    with pytest.raises(SystemExit):
+        main()
+    assert not (tmp_path / "a.gpx").exists()
+
+
+def test_ride_outputs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    paths = [str(tmp_path / "a.rctband"), str(tmp_path / "b.rctband")]
+    write_band(paths[0], ["20250601134549", "20250601134550"])
+    # Overlapping the end of the first clip
+    write_band(paths[1], ["20250601134550", "20250601134551", "20250601134552"])
+    # Clips are ordered by time rather than as given
+    monkeypatch.setattr(
+        sys, "argv", ["rct2gpx", *paths[::-1], "--ride", "--csv", "--no-cache"]
+    )
+    main()
+
+    with open(tmp_path / "combined.gpx") as f:
+        (segment,) = gpxpy.parse(f).tracks[0].segments
+    assert [point.time.second for point in segment.points] == [  # type: ignore[union-attr]
+        49,
+        50,
+        51,
+        52,
+    ]
+    with open(tmp_path / "b.gpx") as f:
+        assert len(gpxpy.parse(f).tracks[0].segments[0].points) == 3
+    with open(tmp_path / "combined.csv") as f:
+        assert [row["datetime"][-2:] for row in csv.DictReader(f)] == [
+            "49",
+            "50",
+            "51",
+            "52",
+        ]
+
+
+def test_cached_outputs(tmp_path: Path) -> None:
+    path = str(tmp_path / "video.rctband")
+    write_band(path, ["20250601134549", "20250601134550"])
+    cache = ResultCache(str(tmp_path / "cache"))
+    output = _parse_video(path, str(tmp_path / "a"), cache=cache)
+    assert output is not None and output[2].counters["cache_misses"] == 1
+
+    # Output options do not change the results
+    output = _parse_video(path, str(tmp_path / "b"), cache=cache)
+    assert output is not None and output[2].counters["cache_hits"] == 1
+    # Nor does ride mode
+    ((_, ride_output),) = parse_ride([path], [str(tmp_path / "c")], cache)
+    assert ride_output is not None and ride_output[2].counters["cache_hits"] == 1
+    assert ride_output[0] == output[0]
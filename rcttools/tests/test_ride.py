@@ -0,0 +1,106 @@
+import datetime as dt
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Iterator
+
+import numpy as np
+import pytest
+
+from ..gpx import GPXWriter
+from ..ride import Prefetcher, RideGPXWriter, parse_ride, probe_start, stitch
+from ..text_format import EmbeddedData
+from .helpers import write_band
+
+
+def _result(start: int, seconds: range) -> Dict[int, EmbeddedData]:
+    return {
+        start
+        + i
+        * 30: EmbeddedData(
+            datetime=dt.datetime(2025, 6, 1, 13, 45) + dt.timedelta(seconds=s),
+            latitude=Decimal("47.62221"),
+            longitude=Decimal("-122.17650"),
+        )
+        for i, s in enumerate(seconds)
+    }
+
+
+def test_stitch() -> None:
+    rows = stitch(
+        {
+            "b.mp4": _result(0, range(29, 60)),
+            "a.mp4": _result(0, range(0, 30)),
+            "empty.mp4": {},
+            "c.mp4": _result(0, range(60, 90)),
+        }
+    )
+    assert [row[2]["datetime"].second for row in rows] == list(range(60)) + list(
+        range(30)
+    )
+    assert [path for path, _, _ in rows[29:31]] == ["a.mp4", "b.mp4"]
+    # The overlapping first update of b.mp4 is dropped
+    assert rows[30][1] == 30
+
+
+def _chunks(count: int, fail: bool = False) -> Iterator[np.ndarray]:
+    for i in range(count):
+        yield np.full((2, 3), i)
+    if fail:
+        raise ValueError("decode failed")
+
+
+def test_prefetcher() -> None:
+    assert [int(chunk[0, 0]) for chunk in Prefetcher(_chunks(5))] == list(range(5))
+
+    prefetcher = Prefetcher(_chunks(5, fail=True))
+    with pytest.raises(ValueError):
+        list(prefetcher)
+
+    # Closing early stops the thread, which is blocked on a full queue
+    prefetcher = Prefetcher(_chunks(100), max_chunks=1)
+    assert int(next(prefetcher)[0, 0]) == 0
+    prefetcher.close()
+    assert not prefetcher.thread.is_alive()
+
+
+def test_parse_ride_order(tmp_path: Path) -> None:
+    # File names out of chronological order
+    paths = [str(tmp_path / f"{name}.rctband") for name in ("a", "b", "c")]
+    write_band(paths[0], ["20250601134553", "20250601134554"])
+    write_band(paths[1], ["20250601134549", "20250601134550"])
+    write_band(paths[2], ["20250601134551", "20250601134552"])
+    assert probe_start(paths[0]) == dt.datetime(2025, 6, 1, 13, 45, 53)
+
+    outputs = list(parse_ride(paths, [str(tmp_path)] * 3))
+    assert [path for path, _ in outputs] == [paths[1], paths[2], paths[0]]
+    assert all(output is not None for _, output in outputs)
+
+
+def test_ride_gpx_writer(tmp_path: Path) -> None:
+    paths = {name: str(tmp_path / f"{name}.gpx") for name in ("a", "b", "c", "d")}
+    combined = GPXWriter(str(tmp_path / "combined.gpx"))
+    with RideGPXWriter(paths, combined) as writer:
+        a = _result(0, range(0, 3))
+        for data in a.values():
+            writer.add("a", data)
+        # Points reach the disk while the video is being parsed
+        writer.writers["a"].file.flush()
+        assert "<trkpt" in (tmp_path / "a.gpx.part").read_text()
+        writer.finish("a", a)
+        # The cached results of b, overlapping a, are written once yielded
+        writer.finish("b", _result(0, range(2, 5)))
+        writer.add("c", _result(0, range(5, 6))[0])
+        writer.finish("c", None)
+        writer.finish("d", {})
+        # Out of order, but not overlapping
+        writer.finish("e", _result(0, range(-3, 0)))
+
+    # The leading update of b was dropped, while the update c read before
+    # failing was kept, and e has a segment of its own
+    assert combined.points == 9
+    assert (tmp_path / "combined.gpx").read_text().count("<trkseg>") == 2
+    assert (tmp_path / "a.gpx").exists() and (tmp_path / "d.gpx").exists()
+    assert "<trkpt" in (tmp_path / "b.gpx").read_text()
+    # c failed
+    assert not (tmp_path / "c.gpx").exists()
+    assert not (tmp_path / "c.gpx.part").exists()
@@ -0,0 +1,26 @@
+import pickle
+from typing import List, Tuple
+
+from ..stats import ParseStats
+
+
+def test_parse_stats() -> None:
+    events: List[Tuple[str, float, float]] = []
+    stats = ParseStats(hooks=[lambda *event: events.append(event)])
+    for _ in range(2):
+        with stats.stage("ocr"):
+            sum(range(1000))
+    stats.add_time("ffmpeg", 0.0, 1.5)
+    stats.count("frames_decoded", 30)
+    stats.count("frames_decoded", 2)
+    stats.count("cache_hits")
+
+    assert [name for name, _, _ in events] == ["ocr", "ocr", "ffmpeg"]
+    assert stats.wall["ocr"] == events[0][1] + events[1][1]
+    assert stats.cpu["ffmpeg"] == 1.5
+    assert stats.counters == {"frames_decoded": 32, "cache_hits": 1}
+
+    # Hooks are dropped when sent back from worker processes
+    copy = pickle.loads(pickle.dumps(stats))
+    assert copy.hooks == []
+    assert copy.to_dict() == stats.to_dict()
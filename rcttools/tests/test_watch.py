@@ -0,0 +1,66 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from ..watch import MANIFEST_NAME, FolderWatcher, Inotify, Manifest
+
+
+def test_settling(tmp_path: Path) -> None:
+    watcher = FolderWatcher(str(tmp_path), settle_seconds=10)
+    video = tmp_path / "clip.MP4"
+    video.write_bytes(b"a")
+    (tmp_path / "notes.txt").write_bytes(b"a")
+
+    watcher.scan(0)
+    watcher.scan(5)
+    assert not watcher.queue
+    # Still being written
+    video.write_bytes(b"ab")
+    watcher.scan(11)
+    assert not watcher.queue
+    watcher.scan(21)
+    assert [path for path, _ in watcher.queue] == [str(video)]
+    watcher.scan(40)
+    assert len(watcher.queue) == 1
+
+    # Videos in the manifest are skipped until they change
+    path, stat = watcher.queue.popleft()
+    watcher.manifest.update(path, stat, status="done")
+    watcher.scan(50)
+    watcher.scan(70)
+    assert not watcher.queue and not watcher.pending
+    assert Manifest(str(tmp_path / MANIFEST_NAME)).is_current(path, os.stat(path))
+
+
+def test_failed_video(tmp_path: Path) -> None:
+    (tmp_path / "broken.mp4").write_bytes(b"not a video")
+    watcher = FolderWatcher(str(tmp_path), settle_seconds=0)
+    try:
+        watcher.scan(0)
+        watcher.scan(0)
+        watcher.submit()
+        assert list(watcher.running) == [str(tmp_path / "broken.mp4")]
+        deadline = time.monotonic() + 60
+        while not watcher.collect() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.close()
+    entry = watcher.manifest.entries[str(tmp_path / "broken.mp4")]
+    assert entry["status"] == "failed"
+    assert not (tmp_path / "broken.gpx").exists()
+
+
+def test_inotify(tmp_path: Path) -> None:
+    try:
+        inotify = Inotify(str(tmp_path))
+    except (OSError, AttributeError):
+        pytest.skip("inotify is not available")
+    try:
+        assert not inotify.wait(0)
+        (tmp_path / "clip.mp4").write_bytes(b"a")
+        assert inotify.wait(1)
+        assert not inotify.wait(0)
+    finally:
+        inotify.close()
@@ -1,6 +1,7 @@
 import datetime as dt
-from decimal import Decimal
-from typing import Dict, List, Optional, Tuple, TypedDict
+from decimal import Decimal, InvalidOperation
+from functools import cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, TypedDict
 
 from .alphabet import NEGATIVE_OR_NOTHING, NEGATIVE_OR_NUMBER, NUMBERS, Character
 from .common import CHAR_WIDTHS
@@ -186,3 +187,79 @@ class StateMachine:
             latitude=self.objects[1].result(),
             longitude=self.objects[2].result(),
         )
+
+
+# Classes of the characters read, by the letter standing in for each class when
+# following the choices of `StateMachine`
+LAYOUT_CLASSES = ("0", "-", " ", "")
+
+
+class Layout(NamedTuple):
+    """
+    x offset and class (index in `LAYOUT_CLASSES`) of each character read by
+    `StateMachine`, for one choice of the optional characters.
+    """
+
+    offsets: Tuple[int, ...]
+    classes: Tuple[int, ...]
+
+
+@cache
+def layouts(use_parity: bool = False) -> Tuple[Layout, ...]:
+    """
+    Every layout `StateMachine` can read.
+
+    Offsets only depend on the class of each character, as digits share a
+    width, so the layouts are the sign and padding choices of each coordinate.
+    """
+    found: List[Layout] = []
+
+    def explore(chars: List[str]) -> None:
+        state_machine = StateMachine(use_parity)
+        offsets: List[int] = []
+        remaining = iter(chars)
+        while not state_machine.is_complete():
+            alphabet = state_machine.get_alphabet()
+            if alphabet == {}:
+                continue
+            offsets.append(state_machine.get_next_offset())
+            char = next(remaining, None)
+            if char is None:
+                for letter in LAYOUT_CLASSES:
+                    if letter in alphabet:
+                        explore(chars + [letter])
+                return
+            state_machine.append(char)
+        classes = tuple(LAYOUT_CLASSES.index(char) for char in chars)
+        found.append(Layout(tuple(offsets), classes))
+
+    explore([])
+    return tuple(found)
+
+
+def embedded_data(chars: Sequence[str]) -> EmbeddedData:
+    """
+    Parse the characters read for a layout, as `StateMachine.result` would,
+    raising ValueError if they do not form a date and coordinates.
+    """
+    date, latitude, longitude = chars[:14], chars[14:23], chars[23:]
+
+    def text(chars: Sequence[str]) -> str:
+        return "".join(chars)
+
+    def coordinate(chars: Sequence[str]) -> Decimal:
+        value = f"{text(chars[:4])}.{text(chars[4:])}".strip()
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise ValueError(f"Invalid coordinate: {value!r}") from None
+
+    return EmbeddedData(
+        datetime=dt.datetime.strptime(
+            f"{text(date[:4])}/{text(date[4:6])}/{text(date[6:8])} "
+            f"{text(date[8:10])}:{text(date[10:12])}:{text(date[12:])} ",
+            "%Y/%m/%d %H:%M:%S ",
+        ),
+        latitude=coordinate(latitude),
+        longitude=coordinate(longitude),
+    )
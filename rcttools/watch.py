@@ -0,0 +1,442 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import datetime as dt
+import json
+import logging
+import os
+import select
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Tuple, Union
+
+from .alphabet import load_glyphs
+from .cache import LayoutCache, ResultCache
+from .detection import SPARSE_SAMPLE_STEP, SPARSE_STACK_STEP
+from .rct2gpx import DECODE_MODES, _init_worker, _parse_video, write_csv
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+    import pandas as pd
+
+    from .stats import ParseStats
+    from .text_format import EmbeddedData
+
+    ParseOutput = Optional[Tuple[dict[int, EmbeddedData], pd.Series[float], ParseStats]]
+
+MANIFEST_NAME = ".rct2gpx-manifest.json"
+# Seconds a video's size and modification time must stay the same before it is
+# parsed, as cameras and file copies write videos over several seconds
+DEFAULT_SETTLE_SECONDS = 10.0
+DEFAULT_POLL_SECONDS = 5.0
+
+# inotify(7) flags; any of these events triggers a scan of the directory
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class Inotify:
+    """
+    Wait for changes to a directory with inotify(7), through libc.
+
+    Changes made by other machines to network shares are not reported, so the
+    directory is still scanned every poll interval.
+    """
+
+    def __init__(self, directory: str) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # Only finished files are reported: videos still being written are
+        # pending, and rescanned every second until they settle
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), directory)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait up to `timeout` seconds for changes, returning whether any
+        happened.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # The events themselves are not needed, as the directory is scanned
+        while True:
+            try:
+                if not os.read(self.fd, 64 * 1024):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Poller:
+    """
+    Wait for the poll interval, on systems or file systems without inotify.
+    """
+
+    def __init__(self, stop: threading.Event) -> None:
+        self.stop = stop
+
+    def wait(self, timeout: float) -> bool:
+        self.stop.wait(timeout)
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+class Manifest:
+    """
+    Status and outputs of each video seen, keyed by path and stored as JSON.
+
+    A video is not parsed again while its size and modification time match its
+    entry, even if it failed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logging.warning(f"Ignoring unreadable manifest {path}", exc_info=True)
+
+    def is_current(self, mp4_path: str, stat: os.stat_result) -> bool:
+        entry = self.entries.get(mp4_path)
+        return (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+        )
+
+    def update(self, mp4_path: str, stat: os.stat_result, **fields: Any) -> None:
+        self.entries[mp4_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            **fields,
+        }
+        self.save()
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def _init_watch_worker(level: int) -> None:
+    _init_worker(level)
+    # Loaded once per worker rather than for the first video of each
+    load_glyphs()
+
+
+class FolderWatcher:
+    """
+    Parse the MP4 files landing in `directory` with a pool of `jobs` worker
+    processes, kept for the lifetime of the watcher.
+
+    Videos are queued once their size and modification time have not changed
+    for `settle_seconds`, and at most `jobs` are parsed at a time. The GPX file
+    of each video (and its CSV file with `csv`) is written to
+    `output_directory`, and its status to the manifest.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        output_directory: str = "",
+        jobs: int = 1,
+        settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+        manifest_path: Optional[str] = None,
+        csv: bool = False,
+        gpx: bool = True,
+        cache: Optional[ResultCache] = None,
+        **parse_kwargs: Any,
+    ) -> None:
+        self.directory = directory
+        self.output_directory = output_directory or directory
+        os.makedirs(self.output_directory, exist_ok=True)
+        self.jobs = jobs
+        self.settle_seconds = settle_seconds
+        self.manifest = Manifest(
+            manifest_path or os.path.join(self.output_directory, MANIFEST_NAME)
+        )
+        self.csv = csv
+        self.gpx = gpx
+        self.cache = cache
+        self.parse_kwargs = {"layouts": LayoutCache(cache), **parse_kwargs}
+        # Size, modification time and when they were first seen, of videos
+        # that may still be written
+        self.pending: Dict[str, Tuple[int, int, float]] = {}
+        self.queue: Deque[Tuple[str, os.stat_result]] = deque()
+        self.running: Dict[str, Tuple[os.stat_result, float, Future[ParseOutput]]] = {}
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.stopped = threading.Event()
+
+    def scan(self, now: float) -> None:
+        """
+        Queue the videos that have settled since the last scan.
+        """
+        queued = {mp4_path for mp4_path, _ in self.queue}
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            logging.warning(f"Failed to list {self.directory}", exc_info=True)
+            return
+        for name in names:
+            if not name.lower().endswith(".mp4"):
+                continue
+            mp4_path = os.path.join(self.directory, name)
+            if mp4_path in self.running or mp4_path in queued:
+                continue
+            try:
+                stat = os.stat(mp4_path)
+            except FileNotFoundError:
+                continue
+            if self.manifest.is_current(mp4_path, stat):
+                self.pending.pop(mp4_path, None)
+                continue
+            seen = self.pending.get(mp4_path)
+            if seen is None or seen[:2] != (stat.st_size, stat.st_mtime_ns):
+                self.pending[mp4_path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif now - seen[2] >= self.settle_seconds:
+                del self.pending[mp4_path]
+                self.queue.append((mp4_path, stat))
+        for mp4_path in list(self.pending):
+            if not os.path.exists(mp4_path):
+                del self.pending[mp4_path]
+
+    def _output_path(self, mp4_path: str, extension: str) -> str:
+        basename = os.path.basename(mp4_path).rsplit(".", 1)[0]
+        return os.path.join(self.output_directory, f"{basename}.{extension}")
+
+    def submit(self) -> None:
+        """
+        Start parsing queued videos, up to `jobs` at a time.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        if self.executor is None:
+            level = logging.getLogger().getEffectiveLevel()
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=_init_watch_worker,
+                initargs=(level,),
+            )
+        while self.queue and len(self.running) < self.jobs:
+            mp4_path, stat = self.queue.popleft()
+            logging.info(f"Parsing {mp4_path}")
+            future = self.executor.submit(
+                _parse_video,
+                mp4_path,
+                self.output_directory,
+                self._output_path(mp4_path, "gpx") if self.gpx else None,
+                self.cache,
+                **self.parse_kwargs,
+            )
+            self.running[mp4_path] = (stat, time.monotonic(), future)
+
+    def collect(self) -> List[str]:
+        """
+        Record the videos that finished parsing, returning their paths.
+        """
+        finished = [p for p, (_, _, future) in self.running.items() if future.done()]
+        for mp4_path in finished:
+            stat, start, future = self.running.pop(mp4_path)
+            if future.cancelled():
+                # Parsed again on the next start
+                continue
+            try:
+                output = future.result()
+            except Exception:
+                # e.g. a worker process was killed
+                logging.exception(f"Failed to parse {mp4_path}")
+                output = None
+            fields: Dict[str, Any] = {
+                "finished": dt.datetime.now().isoformat(timespec="seconds"),
+                "seconds": round(time.monotonic() - start, 3),
+            }
+            if output is None:
+                self.manifest.update(mp4_path, stat, status="failed", **fields)
+                continue
+            result = output[0]
+            outputs = []
+            if self.gpx:
+                outputs.append(self._output_path(mp4_path, "gpx"))
+            if self.csv:
+                csv_path = self._output_path(mp4_path, "csv")
+                write_csv(result, csv_path)
+                outputs.append(csv_path)
+            self.manifest.update(
+                mp4_path,
+                stat,
+                status="done",
+                updates=len(result),
+                outputs=outputs,
+                **fields,
+            )
+            logging.info(f"Parsed {len(result)} updates from {mp4_path}")
+        return finished
+
+    def run(
+        self, poll_seconds: float = DEFAULT_POLL_SECONDS, polling: bool = False
+    ) -> None:
+        """
+        Watch the directory until interrupted or `stop` is called, scanning it
+        every `poll_seconds` or as soon as inotify reports a change.
+        """
+        waiter: Union[Inotify, Poller]
+        try:
+            if polling:
+                raise OSError("polling requested")
+            waiter = Inotify(self.directory)
+        except (OSError, AttributeError) as e:
+            logging.info(f"Polling {self.directory} every {poll_seconds}s: {e}")
+            waiter = Poller(self.stopped)
+        try:
+            while not self.stopped.is_set():
+                self.collect()
+                self.scan(time.monotonic())
+                self.submit()
+                # Wake up sooner to record finished videos and settled ones
+                busy = self.running or self.pending
+                waiter.wait(min(poll_seconds, 1.0) if busy else poll_seconds)
+        finally:
+            waiter.close()
+            self.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def close(self) -> None:
+        """
+        Wait for the videos being parsed, dropping the queued ones.
+        """
+        self.queue.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.collect()
+
+
+def main() -> None:
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(
+        description="Watch a directory and extract GPX data from new MP4 video "
+        "files from Garmin Varia RCT715 devices",
+    )
+    parser.add_argument("directory", type=str, help="Directory to watch")
+    parser.add_argument(
+        "--output-directory",
+        type=str,
+        default="",
+        help="Directory to save output files (default: the watched directory)",
+    )
+    parser.add_argument("--csv", action="store_true", help="Output results to CSV file")
+    parser.add_argument("--no-gpx", action="store_true", help="Do not output GPX file")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of videos to process in parallel (0 to use all CPUs)",
+    )
+    parser.add_argument(
+        "--settle-seconds",
+        type=float,
+        default=DEFAULT_SETTLE_SECONDS,
+        help="Seconds a video must stay unchanged before it is processed",
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=DEFAULT_POLL_SECONDS,
+        help="Seconds between scans of the directory",
+    )
+    parser.add_argument(
+        "--polling",
+        action="store_true",
+        help="Only scan the directory periodically, without inotify",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help=f"Status file of the videos processed (default: {MANIFEST_NAME} in "
+        "the output directory)",
+    )
+    parser.add_argument(
+        "--decode",
+        choices=DECODE_MODES,
+        default="threshold",
+        help="ffmpeg output format; gray and monob decode only the luma plane and "
+        "are faster",
+    )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Score only a few frames per second to find data updates, and stack "
+        "a subset of the frames of each update",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write cached results",
+    )
+    parser.add_argument(
+        "--cache-directory",
+        type=str,
+        default=None,
+        help="Directory of cached results (default: ~/.cache/rcttools)",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    watcher = FolderWatcher(
+        args.directory,
+        output_directory=args.output_directory,
+        jobs=args.jobs or os.cpu_count() or 1,
+        settle_seconds=args.settle_seconds,
+        manifest_path=args.manifest,
+        csv=args.csv,
+        gpx=not args.no_gpx,
+        cache=None if args.no_cache else ResultCache(args.cache_directory),
+        decode=args.decode,
+        sample_step=SPARSE_SAMPLE_STEP if args.sparse else 1,
+        stack_step=SPARSE_STACK_STEP if args.sparse else 1,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    try:
+        watcher.run(args.poll_seconds, args.polling)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()